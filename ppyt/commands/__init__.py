@@ -5,12 +5,17 @@ import os
 import abc
 import json
 import re
+from contextlib import contextmanager, ExitStack
 from datetime import date
 import numpy as np
 from ppyt import const
 from ppyt.exceptions import CommandError, NewInstanceError, ArgumentError
 from ppyt.finders import SimpleFinder
-from ppyt.models.orm import Setting
+from ppyt.indicators import IndicatorCache
+from ppyt.indicators.disk_cache import IndicatorDiskCache
+from ppyt.models.orm import (
+    Setting, DBStats, use_readonly_connection, use_memory_snapshot, start_command_scope,
+    is_schema_outdated)
 
 logger = logging.getLogger(__name__)
 plogger = logging.getLogger('print')
@@ -19,6 +24,13 @@ plogger = logging.getLogger('print')
 class CommandBase(metaclass=abc.ABCMeta):
     """各種コマンドの規定クラスです。"""
 
+    # Trueにすると、commitしないセッション・コネクションが読み込み専用の接続になり、
+    # コマンドの実行中は1つのセッション・コネクションを使い回します。
+    _readonly_db = False
+
+    # Trueにすると、DBのスキーマが古い場合にmigrate_dbコマンドの実行を促して終了します。
+    _check_schema = True
+
     def __init__(self, manager, command, args):
         """コンストラクタ
 
@@ -49,6 +61,9 @@ class CommandBase(metaclass=abc.ABCMeta):
         import argparse
         parser = argparse.ArgumentParser(prog='{} {}'.format(sys.argv[0], self._command))
         parser.add_argument('-v', '--verbose', action='store_true', default=False)
+        if self._readonly_db:
+            # DBファイルをメモリ上に複製してから実行する場合に指定します。
+            parser.add_argument('--in-memory', action='store_true', default=False)
         self._add_options(parser)
         options = parser.parse_args(self._args)
 
@@ -58,9 +73,33 @@ class CommandBase(metaclass=abc.ABCMeta):
 
         try:
             logger.info('{}コマンドを開始します。'.format(self._command))
-            self._execute(options)  # コマンドを実行します。
+
+            if self._readonly_db:
+                if options.in_memory:
+                    use_memory_snapshot()
+                else:
+                    use_readonly_connection()
+
+            if self._check_schema and is_schema_outdated():
+                raise CommandError('DBのスキーマが古くなっています。先に以下のコマンドを実行してください。'
+                                   + os.linesep + './{} migrate_db'.format(self._manager))
+
+            with ExitStack() as stack:
+                if self._readonly_db:
+                    # DBに書き込まないコマンドは、1つのセッション・コネクションを使い回します。
+                    stack.enter_context(start_command_scope())
+                self._execute(options)  # コマンドを実行します。
+
             logger.info('{}コマンドが正常に終了しました。実行時間: {}秒'.format(
                 self._command, round(time.time()-start_time, 2)))
+            logger.info('DBアクセス: {}'.format(DBStats.get_summary()))
+            cache = IndicatorCache.getinstance()
+            if cache.num_hits + cache.num_misses > 0:
+                logger.info('indicatorのキャッシュ: {}'.format(cache.get_summary()))
+            if IndicatorDiskCache.num_hits + IndicatorDiskCache.num_misses > 0:
+                logger.info('indicatorのキャッシュファイル: {}'.format(IndicatorDiskCache.get_summary()))
+            if IndicatorDiskCache.num_saves > 0:
+                IndicatorDiskCache.evict()  # キャッシュファイルが増えた場合は、上限を超えた分を削除します。
 
         except CommandError as e:
             # コマンド実行中に（軽微な）例外が発生したら画面に表示します。
@@ -353,12 +392,89 @@ class CommandBase(metaclass=abc.ABCMeta):
 
     def _iter_rows_from_csvfile(self, filepath, encoding=None, as_dict=False):
         """CSVファイルを読み込んで行を取得します。
+        ファイルは一定サイズずつ読み込むので、ファイルサイズに関わらずメモリ使用量は一定です。
 
         Args:
             filepath: CSVファイルのパス
             encoding: 読み込むCSVファイルのエンコーディング
             as_dict: listではなくdict型で返します。
 
+        Raises:
+            Exception: 拡張子が.csvでない場合に発生します。※拡張子のみで、中身はチェックしません。
+        """
+        with self.__open_csvfile(filepath, encoding) as reader:
+            headers = next(reader, None)
+            if headers is None:
+                return  # 空のファイルの場合は何も返しません。
+
+            for row in reader:
+                if not as_dict:
+                    yield row
+                else:
+                    # dict型として返します。
+                    yield {header_name: row[i] for (i, header_name) in enumerate(headers)}
+
+    def _iter_batches_from_csvfile(self, filepath, encoding=None, batch_size=const.CSV_BATCH_SIZE,
+                                   invalid_rows=None):
+        """CSVファイルを読み込んで、batch_size行ずつ列ごとにまとめて取得します。
+        行ごとにdict型を生成しないので、大きなファイルを配列に変換する場合に使います。
+        列数がヘッダーと異なる行は、列に組み替えられないので取り除きます。
+
+        Args:
+            filepath: CSVファイルのパス
+            encoding: 読み込むCSVファイルのエンコーディング
+            batch_size: 1回に返す最大の行数
+            invalid_rows: 列数がヘッダーと異なる行（値のリスト）を追加するリスト
+                ※Noneの場合は、行を取り除いたことを警告として出力します。
+
+        Yields:
+            key: ヘッダー名、value: その列の値のtupleのdict型オブジェクト
+
+        Raises:
+            Exception: 拡張子が.csvでない場合に発生します。※拡張子のみで、中身はチェックしません。
+        """
+        from itertools import islice
+        with self.__open_csvfile(filepath, encoding) as reader:
+            headers = next(reader, None)
+            if headers is None:
+                return  # 空のファイルの場合は何も返しません。
+
+            num_columns = len(headers)
+            while True:
+                rows = list(islice(reader, batch_size))
+                if not rows:
+                    break
+
+                # zipは一番短い行に合わせて切り詰めるので、列数が異なる行は先に取り除きます。
+                if any(len(row) != num_columns for row in rows):
+                    for row in rows:
+                        if len(row) == num_columns:
+                            continue
+                        if invalid_rows is not None:
+                            invalid_rows.append(row)
+                        else:
+                            logger.warning('ファイル[{}]の列数がヘッダーと異なる行を除外しました。: {}'
+                                           .format(os.path.basename(filepath), row))
+                    rows = [row for row in rows if len(row) == num_columns]
+                    if not rows:
+                        continue
+
+                # 行のリストを列のtupleに組み替えます。
+                columns = list(zip(*rows))
+                yield {header_name: columns[i] for (i, header_name) in enumerate(headers)}
+
+    @contextmanager
+    def __open_csvfile(self, filepath, encoding=None):
+        """CSVファイルを開いてcsv.readerを取得します。
+        改行コード（CR, CRLF）はLFに変換し、空行は飛ばします。
+
+        Args:
+            filepath: CSVファイルのパス
+            encoding: 読み込むCSVファイルのエンコーディング
+
+        Yields:
+            csv.readerオブジェクト
+
         Raises:
             Exception: 拡張子が.csvでない場合に発生します。※拡張子のみで、中身はチェックしません。
         """
@@ -367,21 +483,12 @@ class CommandBase(metaclass=abc.ABCMeta):
             raise Exception('ファイル[{}]の拡張子が.csvではありません。'
                             .format(os.path.basename(filepath)))
         encoding = encoding or const.DEFAULT_FILE_ENCODING
-        with open(filepath, encoding=encoding) as fp:
-            text = fp.read()
-            text = re.sub(r'(?:\r\n|\r)', '\n', text)
-        # 改行コードの違いによって空行があった場合は飛ばします。
-        reader = csv.reader([row for row in text.splitlines(False) if row.strip() != ''])
-        del text
-
-        headers = next(reader)
-
-        for row in reader:
-            if not as_dict:
-                yield row
-            else:
-                # dict型として返します。
-                yield {header_name: row[i] for (i, header_name) in enumerate(headers)}
+
+        # newline=Noneで開くと、CR, CRLFは読み込み時にLFに変換されます。
+        with open(filepath, encoding=encoding, newline=None,
+                  buffering=const.CSV_READ_CHUNK_SIZE) as fp:
+            # 改行コードの違いによって空行があった場合は飛ばします。
+            yield csv.reader(line for line in fp if line.strip() != '')
 
     def _move_to_done_dir(self, filepath):
         """ファイルを完了済みディレクトリに移動します。
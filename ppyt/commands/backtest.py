@@ -3,11 +3,10 @@ import logging
 import os
 import shutil
 from datetime import date, datetime
-from sqlalchemy import func
 from ppyt import const
 from ppyt.commands import CommandBase
 from ppyt.exceptions import CommandError
-from ppyt.models.orm import Stock, start_session
+from ppyt.models.orm import Stock, start_session, refresh_command_snapshot
 from ppyt.trading_manager import BacktestManager
 
 logger = logging.getLogger(__name__)
@@ -17,6 +16,8 @@ plogger = logging.getLogger('print')
 class Command(CommandBase):
     """バックテストを実行するコマンドです。"""
 
+    _readonly_db = True
+
     def _add_options(self, parser):
         """コマンド実行時の引数を定義します。"""
         parser.add_argument('rulefile', type=str, nargs='?', default=None)
@@ -63,7 +64,7 @@ class Command(CommandBase):
 
             if options.symbol is not None:
                 logger.info('銘柄 [{}] を対象とします。'.format(options.symbol))
-                q = q.filter(func.lower(Stock.symbol) == options.symbol.lower())
+                q = q.filter(Stock.symbol_lower == options.symbol.lower())
 
             num_stocks = q.count()  # 対象銘柄数
             if num_stocks == 0:
@@ -74,7 +75,15 @@ class Command(CommandBase):
 
             logger.info('処理対象銘柄は{:,d}件です。'.format(num_stocks))
 
-            for i, stock in enumerate(q.all()):  # 処理対象の銘柄でループ
+            stocks = q.all()
+            for i, stock in enumerate(stocks):  # 処理対象の銘柄でループ
+                if i % const.HISTORY_PREFETCH_SIZE == 0:
+                    # 読み込みのトランザクションを長時間持ち続けて、同時に実行したupdate_dataの
+                    # 書き込みがチェックポイントでDBファイルに反映されなくならないように、開始し直します。
+                    refresh_command_snapshot()
+                    # 銘柄ごとにクエリを発行しないように、履歴データをまとめて取得しておきます。
+                    Stock.prefetch_histories(stocks[i:i + const.HISTORY_PREFETCH_SIZE])
+
                 plogger.info('{: 5,d} / {:,d} 件目を処理しています。({})'.format(
                     i + 1, num_stocks, stock.symbol))
                 stock.set_date(start_date, end_date)
@@ -0,0 +1,29 @@
+# coding: utf-8
+import logging
+import time
+from ppyt import const
+from ppyt.commands import CommandBase
+from ppyt.models.panel import HistoryPanel
+
+logger = logging.getLogger(__name__)
+plogger = logging.getLogger('print')
+
+
+class Command(CommandBase):
+    """全銘柄の取引カレンダーと、日付×銘柄の2次元配列（パネル）を作成するコマンドです。
+    update_dataで履歴データを更新したあとに実行してください。"""
+
+    _readonly_db = True
+
+    def _add_options(self, parser):
+        """コマンド実行時の引数を定義します。"""
+        # 取引カレンダーだけを作成する場合に指定します。
+        parser.add_argument('-c', '--calendar-only', action='store_true')
+
+    def _execute(self, options):
+        """取引カレンダーとパネルを作成します。"""
+        start_time = time.time()
+        num_dates, num_symbols = HistoryPanel.build(calendar_only=options.calendar_only)
+        plogger.info('[{}] に{}を作成しました。日付: {:,d}件, 銘柄: {:,d}件, 処理時間: {:.2f}秒'.format(
+            const.HISTORY_PANEL_DIR, '取引カレンダー' if options.calendar_only else 'パネル',
+            num_dates, num_symbols, time.time() - start_time))
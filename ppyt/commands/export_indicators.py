@@ -2,7 +2,6 @@
 import logging
 import csv
 import os
-from sqlalchemy import func
 from ppyt import const
 from ppyt.finders import SimpleFinder
 from ppyt.exceptions import NoDataError, CommandError
@@ -16,6 +15,8 @@ plogger = logging.getLogger('print')
 class Command(CommandBase):
     """indicatorをCSVに書き出すコマンドです。"""
 
+    _readonly_db = True
+
     def _add_options(self, parser):
         """コマンド実行時の引数を定義します。"""
         # nargs='+'にしていないのは、指定されていないときにindicatorの一覧を表示するためです。
@@ -87,7 +88,7 @@ class Command(CommandBase):
         with start_session() as session:
             q = session.query(Stock)
             if symbol:
-                q = q.filter(func.lower(Stock.symbol) == symbol.lower())
+                q = q.filter(Stock.symbol_lower == symbol.lower())
 
             else:
                 q = q.filter_by(activated=True)
@@ -113,13 +114,21 @@ class Command(CommandBase):
         with open(output_path, 'w', encoding=self.encoding, newline='') as fp:
             w = csv.writer(fp)
             w.writerow(headers)
-            for idx, hist in enumerate(stock.histories):
-                row = [hist.date.strftime('%Y-%m-%d'),
-                       hist.open_price,
-                       hist.high_price,
-                       hist.low_price,
-                       hist.close_price,
-                       hist.volume]
+            hists = stock.histories
+            # 配列はまとめてPythonのオブジェクトに変換しておきます。
+            columns = zip(hists.dates.tolist(),
+                          hists.open_price.tolist(),
+                          hists.high_price.tolist(),
+                          hists.low_price.tolist(),
+                          hists.close_price.tolist(),
+                          hists.volume.tolist())
+            for idx, (d, open_price, high_price, low_price, close_price, volume) in enumerate(columns):
+                row = [d.strftime('%Y-%m-%d'),
+                       open_price,
+                       high_price,
+                       low_price,
+                       close_price,
+                       volume]
                 for i in indicators:
                     try:
                         val = i.get(idx)
@@ -11,6 +11,8 @@ plogger = logging.getLogger('print')
 class Command(CommandBase):
     """バックテストなどの対象になる銘柄を絞り込むコマンドです。"""
 
+    _readonly_db = True  # activatedの更新はcommit=Trueのセッションで行います。
+
     def _add_options(self, parser):
         """コマンド実行時の引数を定義します。"""
         parser.add_argument('filterfile', type=str, nargs='?', default=None)
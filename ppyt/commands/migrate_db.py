@@ -0,0 +1,180 @@
+# coding: utf-8
+import logging
+from sqlalchemy.schema import CreateTable, CreateIndex
+from ppyt.commands import CommandBase
+from ppyt.models.orm import (
+    engine, start_raw_connection, get_history_classes, group_by_history_class,
+    Stock, History, HistoryStatus, FinancialData, Setting)
+
+logger = logging.getLogger(__name__)
+plogger = logging.getLogger('print')
+
+
+class Command(CommandBase):
+    """既存のDBのスキーマを、現在のモデル定義に合わせて変更するコマンドです。
+    何度実行しても、変更が必要な箇所だけが処理されます。"""
+
+    _check_schema = False  # このコマンド自体はスキーマが古い状態で実行します。
+
+    def _add_options(self, parser):
+        """コマンド実行時の引数を定義します。"""
+        pass
+
+    def _execute(self, options):
+        """スキーマを変更します。"""
+        with start_raw_connection(commit=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')  # DDLも含めて1トランザクションで実行します。
+            self.__rebuild_history(cursor)
+            self.__add_stock_columns(cursor)
+            self.__create_indexes(cursor, Stock.__table__, FinancialData.__table__)
+            self.__convert_annual_financial_data(cursor)
+            self.__move_histories_to_shards(cursor)
+            self.__fill_history_status(cursor)
+
+        # 以前のバージョンで作成したDBには、キャッシュの作成元を区別するためのIDがないので登録します。
+        Setting.register_db_id()
+
+        with start_raw_connection(commit=True) as conn:
+            # 統計情報を更新して、クエリプランナーが新しいインデックスを使えるようにします。
+            conn.cursor().execute('ANALYZE')
+            plogger.info('統計情報を更新しました。')
+
+    def __rebuild_history(self, cursor):
+        """historyテーブルを(symbol, date)で並んだWITHOUT ROWIDのテーブルに作り直します。
+
+        Args:
+            cursor: DBのカーソル
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                       (History.__tablename__, ))
+        if 'WITHOUT ROWID' in cursor.fetchone()[0].upper():
+            plogger.info('テーブル[{}]は変更済みです。'.format(History.__tablename__))
+            return
+
+        columns = ', '.join([c.name for c in History.__table__.columns])
+        old_name = History.__tablename__ + '_old'
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(History.__tablename__, old_name))
+        cursor.execute(str(CreateTable(History.__table__).compile(engine)))
+        cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ORDER BY symbol, date'.format(
+            History.__tablename__, columns, old_name))
+        cursor.execute('DROP TABLE {}'.format(old_name))
+        plogger.info('テーブル[{}]をWITHOUT ROWIDで作り直しました。'.format(History.__tablename__))
+
+    def __add_stock_columns(self, cursor):
+        """stockテーブルに後から追加したカラムを追加して、値を設定します。
+
+        Args:
+            cursor: DBのカーソル
+        """
+        # key: カラム名、value: 既存の行に値を設定するSQL（Noneの場合はデフォルト値のままにします。）
+        columns = (
+            ('symbol_lower', 'UPDATE {} SET symbol_lower = lower(symbol)'.format(Stock.__tablename__)),
+            ('data_version', None),
+        )
+        cursor.execute('PRAGMA table_info({})'.format(Stock.__tablename__))
+        existing_names = [row[1] for row in cursor.fetchall()]
+        for name, fill_sql in columns:
+            if name in existing_names:
+                plogger.info('カラム[{}.{}]は追加済みです。'.format(Stock.__tablename__, name))
+                continue
+
+            column = Stock.__table__.columns[name]
+            definition = '{} {}'.format(column.name, column.type.compile(engine.dialect))
+            if column.server_default is not None:
+                # NOT NULLのカラムを追加するには、デフォルト値が必要です。
+                definition += ' NOT NULL DEFAULT {}'.format(column.server_default.arg)
+            cursor.execute('ALTER TABLE {} ADD COLUMN {}'.format(Stock.__tablename__, definition))
+            if fill_sql is not None:
+                cursor.execute(fill_sql)
+            plogger.info('カラム[{}.{}]を追加しました。'.format(Stock.__tablename__, name))
+
+    def __convert_annual_financial_data(self, cursor):
+        """以前のバージョンで取り込んだ年次のファイナンシャルデータを、現在の形式に変換します。
+        以前はQuarterが空の行をquarter = '', period = 'YYYYQ'で保存していましたが、
+        現在はquarter = NULL, period = 'YYYYA'で保存します。
+
+        Args:
+            cursor: DBのカーソル
+        """
+        table_name = FinancialData.__tablename__
+        cursor.execute("SELECT COUNT(*) FROM {} WHERE quarter = ''".format(table_name))
+        num_rows = cursor.fetchone()[0]
+        if num_rows == 0:
+            plogger.info('テーブル[{}]の年次データは変換済みです。'.format(table_name))
+            return
+
+        # 再インポートで現在の形式の行が作成済みの期は、そちらが新しいので古い形式の行を削除します。
+        cursor.execute("DELETE FROM {0} WHERE quarter = '' AND EXISTS ("
+                       "SELECT 1 FROM {0} f WHERE f.symbol = {0}.symbol AND f.period = {0}.year || 'A')"
+                       .format(table_name))
+        num_deletes = cursor.rowcount
+        cursor.execute("UPDATE {} SET quarter = NULL, period = year || 'A' WHERE quarter = ''"
+                       .format(table_name))
+        plogger.info('テーブル[{}]の年次データを変換しました。変換: {:,d}件, 重複のため削除: {:,d}件'.format(
+            table_name, cursor.rowcount, num_deletes))
+
+    def __fill_history_status(self, cursor):
+        """history_statusテーブルが空の場合に、登録済みの履歴データから銘柄ごとの最終日を設定します。
+
+        Args:
+            cursor: DBのカーソル
+        """
+        cursor.execute('SELECT COUNT(*) FROM {}'.format(HistoryStatus.__tablename__))
+        if cursor.fetchone()[0] > 0:
+            plogger.info('テーブル[{}]は設定済みです。'.format(HistoryStatus.__tablename__))
+            return
+
+        num_symbols = 0
+        for history_class in get_history_classes():
+            HistoryStatus.refresh(cursor, history_class.__table__.fullname, history_class)
+            num_symbols += cursor.rowcount
+        plogger.info('テーブル[{}]に{:,d}銘柄の最終日を設定しました。'.format(
+            HistoryStatus.__tablename__, num_symbols))
+
+    def __move_histories_to_shards(self, cursor):
+        """const.HISTORY_SHARDINGで分割している場合に、historyテーブルの履歴データを分割したテーブルに移動します。
+
+        Args:
+            cursor: DBのカーソル
+        """
+        if get_history_classes() == [History]:
+            return  # 分割していない場合は何もしません。
+
+        cursor.execute('SELECT h.symbol, s.market_id FROM (SELECT DISTINCT symbol FROM {}) h '
+                       'INNER JOIN {} s ON s.symbol = h.symbol'.format(
+                           History.__tablename__, Stock.__tablename__))
+        groups = group_by_history_class(cursor.fetchall())
+        if len(groups) == 0:
+            plogger.info('テーブル[{}]に移動する履歴データはありません。'.format(History.__tablename__))
+            return
+
+        columns = ', '.join([c.name for c in History.__table__.columns])
+        for history_class, symbols in groups.items():
+            for i in range(0, len(symbols), HistoryStatus.MAX_SYMBOLS_PER_QUERY):
+                chunk = symbols[i:i + HistoryStatus.MAX_SYMBOLS_PER_QUERY]
+                cursor.execute('INSERT OR REPLACE INTO {0} ({1}) SELECT {1} FROM {2} '
+                               'WHERE symbol IN ({3}) ORDER BY symbol, date'.format(
+                                   history_class.__table__.fullname, columns, History.__tablename__,
+                                   ', '.join(['?'] * len(chunk))), chunk)
+            plogger.info('テーブル[{}]に{:,d}銘柄の履歴データを移動しました。'.format(
+                history_class.__table__.fullname, len(symbols)))
+
+        cursor.execute('DELETE FROM {}'.format(History.__tablename__))
+
+    def __create_indexes(self, cursor, *tables):
+        """モデルに定義されていて、DBにまだないインデックスを作成します。
+
+        Args:
+            cursor: DBのカーソル
+            tables: 対象のテーブル（sqlalchemy.Table）
+        """
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing_names = set(row[0] for row in cursor.fetchall())
+
+        for table in tables:
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name in existing_names:
+                    continue
+                cursor.execute(str(CreateIndex(index).compile(engine)))
+                plogger.info('インデックス[{}]を作成しました。'.format(index.name))
@@ -1,15 +1,39 @@
 # coding: utf-8
 import logging
 import os
+import time
 from datetime import datetime
+import numpy as np
 from ppyt import const
 from ppyt.commands import CommandBase
 from ppyt.exceptions import CommandError
-from ppyt.models.orm import start_session, start_raw_connection, Stock, FinancialData
+from ppyt.models.history_cache import HistoryCache
+from ppyt.models.orm import (
+    start_session, start_raw_connection, get_history_class, group_by_history_class,
+    Stock, HistoryStatus, FinancialData, CorporateAction, ImportedFile, Setting)
+from ppyt.models.series import HistorySeries
+from ppyt.utils import get_file_checksum, str_to_number, strs_to_numbers, strs_to_dates
 
 logger = logging.getLogger(__name__)
 
 
+def _parse_history_worker(command, task_queue, result_queue):
+    """履歴データのCSVファイルを解析するプロセスの処理です。
+    task_queueからファイルパスを受け取り、解析結果をresult_queueに入れます。
+
+    Args:
+        command: update_dataコマンドのインスタンス
+        task_queue: (ファイルの位置, ファイルパス)が入ったキュー（Noneを受け取ったら終了します。）
+        result_queue: (ファイルの位置, (ファイルパス, カラムごとの配列, エラー内容))を入れるキュー
+    """
+    for index, filepath in iter(task_queue.get, None):
+        try:
+            result_queue.put((index, (filepath, command._read_history_columns(filepath), None)))
+        except Exception as e:
+            # 例外は書き込み側のプロセスで処理します。
+            result_queue.put((index, (filepath, None, str(e))))
+
+
 class Command(CommandBase):
     """銘柄データや履歴データを登録・更新するコマンドです。"""
 
@@ -17,17 +41,46 @@ class Command(CommandBase):
     MODE_STOCK = 'stock'
     MODE_HISTORY = 'history'
     MODE_FINANCIAL = 'financial'
+    MODE_SPLIT = 'split'
     MODE_ALL = 'all'
     MODES = (
         MODE_HISTORY,  # 銘柄情報更新モード
         MODE_STOCK,  # 履歴データ更新用モード
         MODE_FINANCIAL,  # Financial Data更新モード
+        MODE_SPLIT,  # 株式分割などのコーポレートアクション反映モード
         MODE_ALL,  # 全実行モード
     )
 
+    # 履歴データのCSVファイルのヘッダーと、historyテーブルのカラムの対応を定義します。
+    HISTORY_CSV_COLUMNS = (
+        ('Symbol', 'symbol'),
+        ('Date', 'date'),
+        ('Close', 'raw_close_price'),
+        ('Adj. Open', const.PRICE_TYPE_OPEN),
+        ('Adj. High', const.PRICE_TYPE_HIGH),
+        ('Adj. Low', const.PRICE_TYPE_LOW),
+        ('Adj. Close', const.PRICE_TYPE_CLOSE),
+        ('Adj. Volume', 'volume'),
+    )
+
+    # 並列処理時に、解析済みのデータを1プロセス当たり何ファイル分までキューに溜めておくかを定義します。
+    HISTORY_QUEUE_SIZE_PER_WORKER = 2
+
+    # 出来高の上限です。これ以上の値はint64に変換できないため、不正なデータとして除外します。
+    HISTORY_MAX_VOLUME = 2.0 ** 63
+
+    # 解析結果を待つ間に、解析側のプロセスが異常終了していないかを確認する間隔（秒）です。
+    HISTORY_RESULT_POLL_SECONDS = 5
+
     def _add_options(self, parser):
         """コマンド実行時の引数を定義します。"""
         parser.add_argument('mode', type=str, nargs='?', default=self.MODE_HISTORY)
+        # 履歴データのCSVファイルを解析するプロセス数を指定できます。
+        parser.add_argument('-w', '--workers', type=int, default=1)
+        # 履歴データのキャッシュファイル（メモリマップ用）を作成する場合に指定します。
+        parser.add_argument('-c', '--cache', action='store_true')
+        # 履歴データを差分だけ取り込む場合に指定します。
+        parser.add_argument('-i', '--incremental', action='store_true')
 
     def _execute(self, options):
         """銘柄などの情報を更新します。"""
@@ -42,13 +95,18 @@ class Command(CommandBase):
                 print('  - {}{}'.format(m, suffix))
             exit()
 
+        # キャッシュの作成元を区別できるように、DBのIDを登録しておきます。
+        Setting.register_db_id()
+
         if mode in (self.MODE_STOCK, self.MODE_ALL):  # 銘柄更新
             for market_id in const.MARKET_DATA.keys():
                 self.__import_stock_list_from_csv(market_id)
 
         # symbolの一覧を取得します。
         with start_session() as session:
-            self.symbols = [s.symbol for s in session.query(Stock).all()]
+            self.market_ids = {symbol: market_id for (symbol, market_id)
+                               in session.query(Stock.symbol, Stock.market_id)}
+            self.symbols = set(self.market_ids.keys())
 
         if mode in (self.MODE_STOCK, self.MODE_FINANCIAL, self.MODE_ALL):  # Financial Data更新
             self.__import_financial_data_from_csv()
@@ -64,7 +122,12 @@ class Command(CommandBase):
                     msg += 'を実行して銘柄情報を取り込んでください。'
                     raise CommandError(msg)
 
-            self.__import_histories_from_csv()
+            self.__import_histories_from_csv(workers=options.workers, cache=options.cache,
+                                             incremental=options.incremental)
+
+        if mode in (self.MODE_SPLIT, self.MODE_ALL):  # コーポレートアクション反映
+            self.__import_corporate_actions_from_csv()
+            self.__apply_corporate_actions(cache=options.cache)
 
     def __import_stock_list_from_csv(self, market_id):
         """銘柄情報をCSVファイルから取得してインポートします。
@@ -81,122 +144,652 @@ class Command(CommandBase):
             raise CommandError('銘柄リスト[{}]のインポートに失敗しました。'
                                'ファイルが存在ません。'.format(filepath))
 
+        rows = [(row['Symbol'], row['Name'], row['Sector'])
+                for row in self._iter_rows_from_csvfile(filepath, as_dict=True)]
+
+        # ファイル1つ分をまとめて1トランザクションで登録・更新します。
         with start_session(commit=True) as session:
-            for row in self._iter_rows_from_csvfile(filepath, as_dict=True):
-                symbol = row['Symbol']
-                name = row['Name']
-                sector_name = row['Sector']
-                Stock.save(session=session, name=name, symbol=symbol,
-                           sector_name=sector_name, market_id=market_id)
+            num_inserts, num_updates = Stock.save_all(session=session, market_id=market_id, rows=rows)
 
         self._move_to_done_dir(filepath)  # importしたファイルを移動します。
-        logger.info('マーケット[{}]の銘柄リストのインポートを終了しました。'.format(market_name))
+        logger.info('マーケット[{}]の銘柄リストのインポートを終了しました。新規: {:,d}件, 更新: {:,d}件'
+                    .format(market_name, num_inserts, num_updates))
 
     def __import_financial_data_from_csv(self):
-        """ファイナンシャルデータをCSVファイルから取得してインポートします。"""
-        def iter_rows():
-            """CSVファイルを読み込み、インポートする情報を取得します。
-
-            Yields:
-                CSVファイルの1行のデータ
-            """
-            dirpath = const.DATA_DIR_FINANCIAL
-            for filename in os.listdir(dirpath):
-                if os.path.splitext(filename)[1] != '.csv':
-                    continue
-                filepath = os.path.join(dirpath, filename)
-                for row in self._iter_rows_from_csvfile(filepath, as_dict=True):
-                    yield row
-
-                self._move_to_done_dir(filepath)  # importしたファイルを移動します。
-
+        """ファイナンシャルデータをCSVファイルから取得してインポートします。
+        銘柄の存在チェックはメモリ上のself.symbolsで行い、ファイル単位でまとめて登録・更新します。
+        """
         logger.info('ファイナンシャルデータのインポートを開始しました。')
         skipped_symbols = set()
-        with start_session(commit=True) as session:
-            for row in iter_rows():
-                logger.debug('row: {}'.format(row))
+        num_inserts, num_updates = 0, 0
+
+        dirpath = const.DATA_DIR_FINANCIAL
+        for filename in sorted(os.listdir(dirpath)):
+            if os.path.splitext(filename)[1] != '.csv':
+                continue
+            filepath = os.path.join(dirpath, filename)
+
+            rows = []
+            for row in self._iter_rows_from_csvfile(filepath, as_dict=True):
                 symbol = row['Symbol']
 
                 if symbol not in self.symbols:
-                    logger.info('銘柄[{}]は登録されていません。'.format(symbol))
-                    continue
-
-                year = row['Year']
-                quarter = row.get('Quarter')
-                filing_date = datetime.strptime(row['Filing Date'], '%Y-%m-%d').date()
-                revenue = row.get('Revenue')
-                net_income = row.get('Net Income')
-                cf_ope = row.get('Cash Flow From Operating Activities')
-                cf_inv = row.get('Cash Flow From Investing Activities')
-                cf_fin = row.get('Cash Flow From Financing Activities')
-
-                q = session.query(Stock).filter_by(symbol=symbol)
-                if not session.query(q.exists()).scalar():
                     skipped_symbols.add(symbol)
                     continue
 
-                stock = q.one()
-                FinancialData.save(session=session, stock=stock, year=year, quarter=quarter,
-                                   filing_date=filing_date, revenue=revenue, net_income=net_income,
-                                   cf_ope=cf_ope, cf_inv=cf_inv, cf_fin=cf_fin)
+                quarter = row.get('Quarter')
+                rows.append({
+                    'symbol': symbol,
+                    'year': int(row['Year']),
+                    'quarter': int(quarter) if quarter else None,  # 空の場合は年次データです。
+                    'filing_date': datetime.strptime(row['Filing Date'], '%Y-%m-%d').date(),
+                    'revenue': row.get('Revenue'),
+                    'net_income': row.get('Net Income'),
+                    'cf_ope': row.get('Cash Flow From Operating Activities'),
+                    'cf_inv': row.get('Cash Flow From Investing Activities'),
+                    'cf_fin': row.get('Cash Flow From Financing Activities'),
+                })
+
+            # ファイル1つ分をまとめて1トランザクションで登録・更新します。
+            with start_session(commit=True) as session:
+                inserts, updates = FinancialData.save_all(session=session, rows=rows)
+                Stock.increment_data_versions(session, sorted(set(row['symbol'] for row in rows)))
+            num_inserts += inserts
+            num_updates += updates
+
+            self._move_to_done_dir(filepath)  # importしたファイルを移動します。
 
         if skipped_symbols:  # 登録できなかった銘柄があった場合
             logger.warn('stockテーブルにレコードがなかったため、'
                         '銘柄[{}]のファイナンシャルデータをインポートできませんでした。'
-                        .format(', '.join(skipped_symbols)))
+                        .format(', '.join(sorted(skipped_symbols))))
+
+        logger.info('ファイナンシャルデータのインポートを終了しました。新規: {:,d}件, 更新: {:,d}件'
+                    .format(num_inserts, num_updates))
+
+    def __import_corporate_actions_from_csv(self):
+        """株式分割などのコーポレートアクションをCSVファイル（Symbol, Date, Ratio）から取得してインポートします。"""
+        logger.info('コーポレートアクションのインポートを開始しました。')
+        num_saved, num_skipped = 0, 0
+        for filename in sorted(os.listdir(const.DATA_DIR_CORPORATE_ACTION)):
+            if os.path.splitext(filename)[1] != '.csv':
+                continue  # CSVファイル以外は無視します。
+
+            filepath = os.path.join(const.DATA_DIR_CORPORATE_ACTION, filename)
+            rows = []
+            # 1行目はヘッダーなので、データは2行目からです。
+            for line_no, row in enumerate(self._iter_rows_from_csvfile(filepath, as_dict=True), start=2):
+                if row['Symbol'] not in self.symbols:
+                    logger.warn('銘柄[{}]は登録されていません。'.format(row['Symbol']))
+                    continue
+
+                try:
+                    ratio = str_to_number(row['Ratio'])
+                    action_date = datetime.strptime(row['Date'], '%Y-%m-%d').date()
+                except ValueError:
+                    ratio, action_date = None, None
 
-        logger.info('ファイナンシャルデータのインポートを終了しました。')
+                if ratio is None or not 0 < ratio < float('inf') or action_date is None:
+                    raise CommandError('ファイル[{}]の{:,d}行目の銘柄[{}]の日付[{}]、または分割比率[{}]が不正です。'
+                                       .format(filename, line_no, row['Symbol'], row['Date'], row['Ratio']))
 
-    def __import_histories_from_csv(self):
-        """履歴関連のデータをCSVファイルから取得してインポートします。"""
-        def generate_row():
-            for filename in os.listdir(const.DATA_DIR_HISTORY):
-                if os.path.splitext(filename)[1] != '.csv':
-                    continue  # CSVファイル以外は無視します。
+                rows.append({
+                    'symbol': row['Symbol'],
+                    'date': action_date,
+                    'ratio': ratio,
+                })
 
-                logger.info('ファイル[{}]をインポートします。'.format(
-                    filename))
+            with start_session(commit=True) as session:
+                saved, skipped = CorporateAction.save_all(session, rows)
+            num_saved += saved
+            num_skipped += skipped
+            self._move_to_done_dir(filepath)  # importしたファイルを移動します。
 
-                with start_raw_connection(commit=True) as conn:
-                    filepath = os.path.join(const.DATA_DIR_HISTORY, filename)
-                    for row in self._iter_rows_from_csvfile(filepath, as_dict=True):
-                        yield conn, row
+        logger.info('コーポレートアクションのインポートを終了しました。登録: {:,d}件, 反映済み: {:,d}件'
+                    .format(num_saved, num_skipped))
 
-                self._move_to_done_dir(filepath)  # importしたファイルを移動します。
-                logger.info('ファイル[{}]のインポートが完了しました。'.format(
-                    filename))
+    def __apply_corporate_actions(self, cache=False):
+        """未反映のコーポレートアクションを、銘柄ごとに1回のUPDATEで履歴データに反映します。
+        CSVファイルを再インポートせずに、調整後の価格を調整し直せます。
 
+        Args:
+            cache: Trueの場合は、調整した銘柄のキャッシュファイルを作り直します。
+        """
+        with start_session() as session:
+            symbols = sorted(set(symbol for (symbol, ) in session.query(CorporateAction.symbol)
+                                 .filter_by(applied=False)))
+
+        total_rows = 0
+        with start_raw_connection(commit=True) as conn:
+            cursor = conn.cursor()
+            for symbol in symbols:
+                history_class = get_history_class(symbol, self.market_ids[symbol])
+                total_rows += CorporateAction.apply_pending(cursor, symbol, history_class)
+
+        # 調整前の価格のキャッシュが使われないようにします。
+        self.__refresh_history_caches(symbols, cache)
+        logger.info('コーポレートアクションを反映しました。銘柄: {:,d}件, 履歴データ: {:,d}件'.format(
+            len(symbols), total_rows))
+
+    def __import_histories_from_csv(self, workers=1, cache=False, incremental=False):
+        """履歴関連のデータをCSVファイルから取得してインポートします。
+        ファイル単位で列ごとの配列に変換し、ステージングテーブル経由でまとめて登録・更新します。
+
+        Args:
+            workers: CSVファイルの解析に使うプロセス数（1以下の場合はこのプロセスだけで処理します。）
+            cache: Trueの場合は、更新した銘柄のキャッシュファイルを作り直します。
+            incremental: Trueの場合は、インポート済みのファイルと、取り込み済みの日付以前の行をスキップします。
+        """
         logger.info('履歴データインポートを開始しました。')
+        start_time = time.time()
+        total_rows = 0
+
+        filepaths = [os.path.join(const.DATA_DIR_HISTORY, filename)
+                     for filename in sorted(os.listdir(const.DATA_DIR_HISTORY))
+                     if os.path.splitext(filename)[1] == '.csv']  # CSVファイル以外は無視します。
+
+        checksums = {}
+        if incremental:
+            filepaths, checksums = self.__skip_imported_files(filepaths)
+
+        if workers > 1:
+            iter_columns = self.__iter_history_columns_parallel(filepaths, workers)
+        else:
+            iter_columns = self.__iter_history_columns(filepaths)
+
+        # DBへの書き込みはこのプロセスだけで行います。
+        file_start_time = time.time()
+        for filepath, columns in iter_columns:
+            filename = os.path.basename(filepath)
+            if incremental:
+                columns = self.__filter_new_histories(columns)
+
+            num_rows = self.__upsert_histories(columns)
+            total_rows += num_rows
+            self.__refresh_history_caches(np.unique(columns['symbol']).tolist(), cache)
+
+            if incremental:
+                # 同じ内容のファイルを次回以降スキップできるように記録します。
+                with start_session(commit=True) as session:
+                    session.merge(ImportedFile(checksum=checksums[filepath],
+                                               filename=filename, num_rows=num_rows))
+
+            self._move_to_done_dir(filepath)  # コミットしたファイルを移動します。
+            logger.info('ファイル[{}]のインポートが完了しました。{}'.format(
+                filename, self.__format_speed(num_rows, time.time() - file_start_time)))
+            file_start_time = time.time()
+
+        logger.info('履歴データインポートを終了しました。{}'.format(
+            self.__format_speed(total_rows, time.time() - start_time)))
+
+    def __skip_imported_files(self, filepaths):
+        """チェックサムが記録済みのファイル（インポート済みのファイルと同じ内容のファイル）を除外します。
+        除外したファイルは、解析せずにdoneディレクトリに移動します。
 
-        for conn, row in generate_row():
-            symbol = row['Symbol']
-            date = datetime.strptime(row['Date'], '%Y-%m-%d').date()
+        Args:
+            filepaths: CSVファイルのパスのリスト
 
-            if symbol not in self.symbols:
-                logger.warn('銘柄[{}]は登録されていません。'.format(symbol))
+        Returns:
+            インポートするファイルパスのリスト
+            key: ファイルパス、value: チェックサムのdict型オブジェクト
+        """
+        checksums = {filepath: get_file_checksum(filepath) for filepath in filepaths}
+        with start_session() as session:
+            imported = set(checksum for (checksum, ) in session.query(ImportedFile.checksum)
+                           .filter(ImportedFile.checksum.in_(list(checksums.values()))))
+
+        targets = []
+        for filepath in filepaths:
+            checksum = checksums[filepath]
+            if checksum in imported:
+                logger.info('ファイル[{}]はインポート済みなのでスキップします。'.format(
+                    os.path.basename(filepath)))
+                self._move_to_done_dir(filepath)
                 continue
 
-            logger.debug('[Symbol: {}, Date: {:%Y-%m-%d}]を登録します。'.format(
-                symbol, date))
+            imported.add(checksum)  # 同じ内容のファイルが複数ある場合は、最初の1つだけを対象にします。
+            targets.append(filepath)
+
+        return targets, checksums
+
+    def __filter_new_histories(self, columns):
+        """取り込み済みの最終日（ハイウォーターマーク）より後の行だけに絞り込みます。
+        ただし、最終日の行の価格がDBと異なる銘柄は、株式分割などで過去の価格が修正されたものとして、
+        ファイルに含まれる全ての行を対象にします。
+
+        Args:
+            columns: key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+
+        Returns:
+            絞り込んだcolumns
+        """
+        num_rows = len(columns['symbol'])
+        if num_rows == 0:
+            return columns
+
+        symbols, inverse = np.unique(columns['symbol'], return_inverse=True)
+        last_histories = {}
+        for history_class, class_symbols in group_by_history_class(
+                [(symbol, self.market_ids[symbol]) for symbol in symbols.tolist()]).items():
+            last_histories.update(HistoryStatus.get_last_histories(class_symbols, history_class))
+        last_dates = np.array([last_histories[s][0] if s in last_histories else 'NaT'
+                               for s in symbols.tolist()], dtype='datetime64[D]')[inverse]
+        mask = np.isnat(last_dates) | (columns['date'] > last_dates)
+
+        # 最終日の行を比較して、取り込み済みの価格が修正されていないかを確認します。
+        restated = set()
+        for idx in np.flatnonzero(columns['date'] == last_dates).tolist():
+            symbol = columns['symbol'][idx]
+            values = [columns[c][idx] for c in HistorySeries.COLUMNS[1:]]
+            if not np.allclose(values, last_histories[symbol][1:]):
+                restated.add(symbol)
+
+        if restated:
+            logger.warning('以下の銘柄は取り込み済みの価格が修正されているため、'
+                           'ファイルに含まれる全ての行を更新します。: {}'.format(', '.join(sorted(restated))))
+            mask |= np.isin(columns['symbol'], list(restated))
+
+        logger.info('取り込み済みの{:,d}件をスキップします。'.format(num_rows - int(mask.sum())))
+        return {column: arr[mask] for column, arr in columns.items()}
+
+    def __iter_history_columns(self, filepaths):
+        """CSVファイルを順番に解析して、カラムごとの配列を取得します。
+
+        Args:
+            filepaths: 解析するCSVファイルのパスのリスト
+
+        Yields:
+            CSVファイルのパス
+            key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+        """
+        for filepath in filepaths:
+            logger.info('ファイル[{}]をインポートします。'.format(os.path.basename(filepath)))
+            yield filepath, self._read_history_columns(filepath)
+
+    def __iter_history_columns_parallel(self, filepaths, workers):
+        """複数のプロセスでCSVファイルを並列に解析して、カラムごとの配列を取得します。
+        解析が終わった順ではなく、filepathsの順番（順番に処理する場合と同じ順番）で取得します。
+        同じ銘柄・日付の行が複数のファイルにある場合に、どちらで登録・更新されるかを変えないためです。
+        解析を依頼するのは取得待ちのファイルから一定数先までなので、書き込みが追いつかない場合や、
+        先頭のファイルの解析に時間がかかる場合でも、解析済みのデータが溜まり続けることはありません。
+
+        Args:
+            filepaths: 解析するCSVファイルのパスのリスト
+            workers: 解析に使うプロセス数
+
+        Yields:
+            CSVファイルのパス
+            key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+        """
+        import multiprocessing
+        workers = min(workers, len(filepaths))
+        if workers == 0:
+            return
+
+        logger.info('{}プロセスでCSVファイルを解析します。'.format(workers))
+        window = workers * self.HISTORY_QUEUE_SIZE_PER_WORKER  # 同時に解析を依頼するファイル数
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue(maxsize=window)
+        processes = [multiprocessing.Process(target=_parse_history_worker,
+                                             args=(self, task_queue, result_queue))
+                     for _ in range(workers)]
+        for p in processes:
+            p.start()
+
+        num_tasks = 0
+        buffered = {}  # key: filepathsでの位置、value: 解析結果
+        try:
+            for index in range(len(filepaths)):
+                # 取得待ちのファイルからwindow件先までの解析を依頼します。
+                while num_tasks < min(index + window, len(filepaths)):
+                    task_queue.put((num_tasks, filepaths[num_tasks]))
+                    num_tasks += 1
+                    if num_tasks == len(filepaths):
+                        for _ in range(workers):
+                            task_queue.put(None)  # 終了の合図です。
+
+                # 次のファイルの結果が届くまで、先に届いた結果は取っておきます。
+                while index not in buffered:
+                    result_index, result = self.__get_parse_result(result_queue, processes)
+                    buffered[result_index] = result
+
+                filepath, columns, error = buffered.pop(index)
+                if error is not None:
+                    raise CommandError('ファイル[{}]の解析に失敗しました。原因: {}'.format(
+                        os.path.basename(filepath), error))
+                yield filepath, columns
+
+            for p in processes:
+                p.join()
+
+        finally:
+            for p in processes:
+                if p.is_alive():
+                    # 途中で終了した場合は残っているプロセスを停止します。
+                    p.terminate()
+
+    def __get_parse_result(self, result_queue, processes):
+        """解析結果を1件取得します。解析側のプロセスが異常終了した場合は、待ち続けずに例外を投げます。
+
+        Args:
+            result_queue: 解析結果が入るキュー
+            processes: 解析側のプロセスのリスト
+
+        Returns:
+            (filepathsでの位置, (ファイルパス, カラムごとの配列, エラー内容))のtuple
+
+        Raises:
+            CommandError: 解析側のプロセスが異常終了した、または結果を返さずに終了した場合に発生します。
+        """
+        import queue
+        while True:
+            try:
+                return result_queue.get(timeout=self.HISTORY_RESULT_POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+            exitcodes = [p.exitcode for p in processes]
+            failed = [code for code in exitcodes if code not in (None, 0)]
+            if failed:
+                raise CommandError('CSVファイルを解析するプロセスが異常終了しました。終了コード: {}'
+                                   .format(', '.join(str(code) for code in failed)))
+            if all(code == 0 for code in exitcodes):
+                raise CommandError('CSVファイルを解析するプロセスが、結果を返さずに終了しました。')
+
+    def _read_history_columns(self, filepath):
+        """履歴データのCSVファイルを読み込み、historyテーブルのカラムごとの配列に変換します。
+        バッチごとに配列へ変換・検証してから連結するので、ファイル全体を文字列のまま保持することはありません。
+        未登録の銘柄の行と、検証に通らなかった行は取り除きます。
+        ※並列処理時は別プロセスから呼ばれるため、DBにはアクセスしないようにしてください。
+
+        Args:
+            filepath: CSVファイルのパス
+
+        Returns:
+            key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+        """
+        parts, positions = [], []
+        rejected = []  # 検証に通らなかった行の(CSVファイルの値のリスト, 理由)のリスト
+        unknown_symbols = set()
+        invalid_rows = []  # 列数がヘッダーと異なる行のリスト
+        offset = 0
+        for batch in self._iter_batches_from_csvfile(filepath, invalid_rows=invalid_rows):
+            raw_columns = {column: batch[header] for (header, column) in self.HISTORY_CSV_COLUMNS}
+            columns, indices = self.__convert_history_batch(raw_columns, unknown_symbols, rejected)
+            parts.append(columns)
+            positions.append(indices + offset)
+            offset += len(raw_columns['symbol'])
+
+        # 列数が異なる行は、どの値がどの列か分からないので、CSVファイルの値をそのまま出力します。
+        rejected.extend((row, '列数がヘッダーと異なります') for row in invalid_rows)
+
+        for symbol in sorted(unknown_symbols):
+            # 未登録の銘柄は1回だけ警告を出します。
+            logger.warn('銘柄[{}]は登録されていません。'.format(symbol))
+
+        if not parts:  # 空のファイルの場合は、空の配列を返します。
+            empty = {column: () for (_, column) in self.HISTORY_CSV_COLUMNS}
+            return self.__convert_history_batch(empty, unknown_symbols, rejected)[0]
+
+        columns = {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+        positions = np.concatenate(positions)
+
+        # 同じ銘柄・日付の行はバッチをまたいで存在しうるので、連結してから検証します。
+        duplicated = self.__find_duplicated_histories(columns)
+        if duplicated.any():
+            rejected.extend(self.__read_raw_histories(filepath, positions[duplicated], '日付が重複しています'))
+            columns = {column: arr[~duplicated] for column, arr in columns.items()}
+
+        if rejected:
+            # 検証に通らなかった行は、理由と一緒に別ファイルに出力します。
+            self.__write_rejected_histories(filepath, rejected)
+
+        return columns
+
+    def __convert_history_batch(self, raw_columns, unknown_symbols, rejected):
+        """CSVファイルのバッチ1つ分を、historyテーブルのカラムごとの配列に変換して検証します。
+
+        Args:
+            raw_columns: key: historyテーブルのカラム名、value: CSVファイルの値のtupleのdict型オブジェクト
+            unknown_symbols: 未登録の銘柄を追加するset（このメソッドで更新します。）
+            rejected: 検証に通らなかった行を追加するリスト（このメソッドで更新します。）
+
+        Returns:
+            key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+            取り出した各行の、バッチ内での位置の配列
+        """
+        # 同じ銘柄の行は同じ文字列のオブジェクトを参照させて、バッチの文字列を保持しないようにします。
+        unique_symbols, inverse = np.unique(np.array(raw_columns['symbol'], dtype=object),
+                                            return_inverse=True)
+        symbols = unique_symbols[inverse]
+        batch_symbols = set(unique_symbols.tolist())
+        unknown_symbols |= batch_symbols - self.symbols
+
+        mask = np.isin(symbols, list(batch_symbols & self.symbols))
+        columns = {
+            'symbol': symbols[mask],
+            'date': strs_to_dates(raw_columns['date'])[mask],  # 日付を一括で解析します。
+        }
+        for column in HistorySeries.COLUMNS:
+            if column not in columns:
+                # 不正な値は検証で除外するので、ここではNaNにしておきます。
+                columns[column] = strs_to_numbers(raw_columns[column], strict=False)[mask]
+
+        indices = np.flatnonzero(mask)
+        invalids = self.__validate_history_columns(columns)
+        if invalids:
+            # 検証に通らなかった行だけ、CSVファイルの値を残しておきます。
+            reasons = list(invalids.keys())
+            invalid_matrix = np.array([invalids[r] for r in reasons])
+            invalid_mask = invalid_matrix.any(axis=0)
+            for i in np.flatnonzero(invalid_mask).tolist():
+                rejected.append((
+                    [raw_columns[column][indices[i]] for (_, column) in self.HISTORY_CSV_COLUMNS],
+                    ' / '.join([r for r, row in zip(reasons, invalid_matrix[:, i]) if row])))
+            columns = {column: arr[~invalid_mask] for column, arr in columns.items()}
+            indices = indices[~invalid_mask]
+
+        columns['volume'] = columns['volume'].astype(np.int64)
+        return columns, indices
+
+    def __validate_history_columns(self, columns):
+        """カラムごとの配列をまとめて検証します。
+        ※同じ銘柄・日付の行の検証は、__find_duplicated_historiesで行います。
 
-            delete_sql = 'DELETE FROM history WHERE symbol = ? AND date = ?'
-            insert_sql = '''INSERT INTO history (
-    symbol, date, raw_close_price, open_price, high_price,
-    low_price, close_price, volume
-) VALUES (
-    ?, ?, ?, ?, ?, ?, ?, ?
-)'''
+        Args:
+            columns: key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+
+        Returns:
+            key: 不正な理由、value: 不正な行がTrueになっている配列のdict型オブジェクト
+            ※不正な行がない検証は含まれません。
+        """
+        dates, volume = columns['date'], columns['volume']
+        open_price = columns[const.PRICE_TYPE_OPEN]
+        high_price = columns[const.PRICE_TYPE_HIGH]
+        low_price = columns[const.PRICE_TYPE_LOW]
+        close_price = columns[const.PRICE_TYPE_CLOSE]
+        prices = [columns[c] for c in HistorySeries.COLUMNS if c not in ('date', 'volume')]
+        tolerance = const.MIN_PRICE_UPDOWN  # 調整後の価格の丸め誤差を許容します。
+
+        # 調整後の終値と調整前の終値の比率（株式分割などの調整率）です。
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = close_price / columns['raw_close_price']
+        min_rate, max_rate = const.HISTORY_VALID_RATE_RANGE
+
+        checks = (
+            ('日付を解析できません', np.isnat(dates)),
+            # "inf"や"nan"もfloatには変換できてしまうので、有限の値かどうかで判定します。
+            ('数値に変換できない値があります', np.any([~np.isfinite(arr) for arr in prices + [volume]], axis=0)),
+            ('価格が0以下です', np.any([arr <= 0 for arr in prices], axis=0)),
+            ('高値が安値を下回っています', high_price < low_price - tolerance),
+            ('始値が高値・安値の範囲外です',
+             (open_price < low_price - tolerance) | (open_price > high_price + tolerance)),
+            ('終値が高値・安値の範囲外です',
+             (close_price < low_price - tolerance) | (close_price > high_price + tolerance)),
+            ('出来高がマイナスです', volume < 0),
+            ('出来高が大きすぎます', volume >= self.HISTORY_MAX_VOLUME),
+            ('調整後と調整前の終値の比率が範囲外です', (rate < min_rate) | (rate > max_rate)),
+        )
+        return {reason: invalid for (reason, invalid) in checks if invalid.any()}
+
+    def __find_duplicated_histories(self, columns):
+        """同じ銘柄・日付の行を探します。どれが正しいか分からないので、重複している行は全て不正にします。
+
+        Args:
+            columns: key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+
+        Returns:
+            重複している行がTrueになっている配列
+        """
+        dates = columns['date']
+        _, symbol_ids = np.unique(columns['symbol'], return_inverse=True)
+        order = np.lexsort((dates.view(np.int64), symbol_ids))
+        same_as_prev = ((symbol_ids[order][1:] == symbol_ids[order][:-1])
+                        & (dates[order][1:] == dates[order][:-1]))
+        duplicated = np.zeros(len(dates), dtype=bool)
+        duplicated[order[1:][same_as_prev]] = True
+        duplicated[order[:-1][same_as_prev]] = True
+        return duplicated
+
+    def __read_raw_histories(self, filepath, positions, reason):
+        """CSVファイルを読み直して、指定した位置の行の値を取得します。
+        検証済みの行の文字列は保持していないので、重複していた行を出力する場合に使います。
+
+        Args:
+            filepath: CSVファイルのパス
+            positions: 取得する行の、列数が正しいデータ行の中での位置（0始まり）の配列
+            reason: 不正な理由
+
+        Returns:
+            (CSVファイルの値のリスト, 理由)のリスト
+        """
+        positions = np.sort(positions)
+        rows = []
+        offset = 0
+        # 列数が異なる行は読み込み済みなので、ここでは捨てます。
+        for batch in self._iter_batches_from_csvfile(filepath, invalid_rows=[]):
+            raw_columns = [batch[header] for (header, _) in self.HISTORY_CSV_COLUMNS]
+            num_rows = len(raw_columns[0])
+            targets = positions[(positions >= offset) & (positions < offset + num_rows)] - offset
+            rows.extend(([values[i] for values in raw_columns], reason) for i in targets.tolist())
+            offset += num_rows
+
+        return rows
+
+    def __write_rejected_histories(self, filepath, rejected):
+        """検証に通らなかった行を、理由と一緒にCSVファイルに出力します。
+        出力先はdoneディレクトリと同じ構成で、rejectedディレクトリの下になります。
+
+        Args:
+            filepath: 読み込んだCSVファイルのパス
+            rejected: (CSVファイルの値のリスト, 理由)のリスト
+        """
+        import csv
+        dest_path = os.path.join(const.DATA_DIR_REJECTED,
+                                 self._yyyymmdd,
+                                 os.path.relpath(filepath, const.DATA_DIR))
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with open(dest_path, 'w', encoding=const.DEFAULT_FILE_ENCODING, newline='') as fp:
+            writer = csv.writer(fp, quoting=csv.QUOTE_ALL)
+            writer.writerow([header for (header, _) in self.HISTORY_CSV_COLUMNS] + ['Reason'])
+            for values, reason in rejected:
+                writer.writerow(values + [reason])
+
+        logger.warning('ファイル[{}]の{:,d}行を不正なデータとして除外し、[{}]に出力しました。'.format(
+            os.path.basename(filepath), len(rejected), dest_path))
+
+    def __upsert_histories(self, columns):
+        """カラムごとの配列をステージングテーブルに一括登録し、historyテーブルへまとめて反映します。
+        ファイル1つ分を1トランザクションで処理します。
 
-            # Delete → Insertを実行します。
+        Args:
+            columns: key: historyテーブルのカラム名、value: 値の配列のdict型オブジェクト
+
+        Returns:
+            登録・更新した件数
+        """
+        num_rows = len(columns['symbol'])
+        if num_rows == 0:
+            return 0
+
+        column_names = ('symbol', ) + HistorySeries.COLUMNS
+        str_columns = ', '.join(column_names)
+
+        with start_raw_connection(commit=True) as conn:
             cursor = conn.cursor()
-            cursor.execute(delete_sql, (symbol, date))
-            cursor.execute(insert_sql, (symbol,
-                                        date,
-                                        row['Close'],
-                                        row['Adj. Open'],
-                                        row['Adj. High'],
-                                        row['Adj. Low'],
-                                        row['Adj. Close'],
-                                        row['Adj. Volume']))
-
-        logger.info('履歴データインポートを終了しました。')
+            # 一時テーブルはコネクションごとに作成されるので、存在しない場合だけ作成します。
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS history_staging '
+                           'AS SELECT {} FROM history WHERE 0'.format(str_columns))
+
+            # 履歴データのテーブルを分割している場合は、テーブルごとに登録・更新します。
+            for history_class, mask in self.__split_by_history_class(columns['symbol']):
+                class_columns = [columns['symbol'][mask], columns['date'][mask].astype(str)]
+                class_columns += [columns[c][mask] for c in HistorySeries.COLUMNS[1:]]
+
+                cursor.execute('DELETE FROM history_staging')
+                # Pythonのオブジェクトに変換するのは一定件数ずつにして、メモリ使用量を抑えます。
+                for start in range(0, len(class_columns[0]), const.CSV_BATCH_SIZE):
+                    rows = zip(*[arr[start:start + const.CSV_BATCH_SIZE].tolist() for arr in class_columns])
+                    cursor.executemany('INSERT INTO history_staging ({}) VALUES ({})'.format(
+                        str_columns, ', '.join(['?'] * len(column_names))), rows)
+
+                # ステージングテーブルの内容で履歴データのテーブルを登録・更新します。
+                cursor.execute('INSERT OR REPLACE INTO {0} ({1}) SELECT {1} FROM history_staging'
+                               .format(history_class.__table__.fullname, str_columns))
+
+                # 取り込んだ銘柄の最終日とデータのバージョンを更新します。
+                HistoryStatus.refresh(cursor, 'history_staging', history_class)
+                Stock.increment_data_versions_in(cursor, 'history_staging')
+
+        return num_rows
+
+    def __split_by_history_class(self, symbols):
+        """行を、履歴データを保存するテーブルのクラスごとに分けます。
+
+        Args:
+            symbols: 各行のシンボルの配列
+
+        Returns:
+            (HistoryBaseを継承したクラス, 対象の行がTrueになっている配列)のリスト
+        """
+        unique_symbols, inverse = np.unique(symbols, return_inverse=True)
+        groups = group_by_history_class(
+            [(symbol, self.market_ids[symbol]) for symbol in unique_symbols.tolist()])
+        if len(groups) == 1:
+            return [(next(iter(groups)), np.ones(len(symbols), dtype=bool))]
+
+        return [(history_class, np.isin(inverse, np.flatnonzero(np.isin(unique_symbols, class_symbols))))
+                for history_class, class_symbols in groups.items()]
+
+    def __refresh_history_caches(self, symbols, cache):
+        """履歴データを更新した銘柄のキャッシュファイルを作り直すか、削除します。
+        古いキャッシュが残ると、DBと異なるデータでbacktestなどが実行されてしまうためです。
+
+        Args:
+            symbols: 履歴データを更新した銘柄のシンボルのリスト
+            cache: Trueの場合は作り直し、Falseの場合は削除します。
+        """
+        if not cache:
+            for symbol in symbols:
+                HistoryCache.invalidate(symbol)
+            return
+
+        # キャッシュには、作成元のデータのバージョンを記録します。
+        with start_session() as session:
+            data_versions = Stock.get_data_versions(session, list(symbols))
+        for symbol in symbols:
+            history_class = get_history_class(symbol, self.market_ids[symbol])
+            HistoryCache.save(symbol, history_class.get_series(symbol), data_versions[symbol])
+
+    def __format_speed(self, num_rows, seconds):
+        """インポートの処理件数と処理速度を表す文字列を取得します。
+
+        Args:
+            num_rows: 処理件数
+            seconds: 処理時間（秒）
+
+        Returns:
+            処理件数と1秒あたりの処理件数の文字列
+        """
+        rate = num_rows / seconds if seconds > 0 else 0
+        return '件数: {:,d}件, 速度: {:,.0f}件/秒'.format(num_rows, rate)
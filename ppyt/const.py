@@ -10,19 +10,53 @@ DATA_DIR = os.path.join(PRJ_DIR, 'data')
 DATA_DIR_STOCKLIST = os.path.join(DATA_DIR, 'stock_list')
 DATA_DIR_FINANCIAL = os.path.join(DATA_DIR, 'financial_data')
 DATA_DIR_HISTORY = os.path.join(DATA_DIR, 'history')
+DATA_DIR_CORPORATE_ACTION = os.path.join(DATA_DIR, 'corporate_action')  # 株式分割などのCSVファイルの置き場所
+DATA_DIR_REJECTED = os.path.join(DATA_DIR, 'rejected')  # update_dataで除外した行の出力先
+DATA_DIR_CACHE = os.path.join(DATA_DIR, 'cache')  # update_dataで作成するキャッシュの置き場所
+HISTORY_CACHE_DIR = os.path.join(DATA_DIR_CACHE, 'history')  # 履歴データのキャッシュの置き場所
+HISTORY_PANEL_DIR = os.path.join(DATA_DIR_CACHE, 'panel')  # 日付×銘柄の2次元配列の置き場所
+INDICATOR_CACHE_DIR = os.path.join(DATA_DIR_CACHE, 'indicator')  # indicatorのキャッシュの置き場所
 DATA_SUB_DIRS = (
     DATA_DIR_STOCKLIST,
     DATA_DIR_FINANCIAL,
     DATA_DIR_HISTORY,
+    DATA_DIR_CORPORATE_ACTION,
 )
 OUTPUT_DIR = os.path.join(PRJ_DIR, 'output')
 OUTPUT_BACKTEST_DIR = os.path.join(OUTPUT_DIR, 'backtest')
 OUTPUT_INDICATOR_DIR = os.path.join(OUTPUT_DIR, 'indicators')
 
 # DB接続情報
-DSN = 'sqlite:///{}'.format(
-    os.path.join(PRJ_DIR, 'db.sqlite3')
-)
+DB_PATH = os.path.join(PRJ_DIR, 'db.sqlite3')
+DSN = 'sqlite:///{}'.format(DB_PATH)
+HISTORY_SHARD_DB_PATH = os.path.join(PRJ_DIR, 'db_{}.sqlite3')  # 分割した履歴データのDBファイル（{}はテーブル名）
+
+# SQLiteの接続時に設定するPRAGMAのプロファイルを定義します。
+SQLITE_PROFILE_DEFAULT = 'default'  # SQLiteのデフォルトのまま
+SQLITE_PROFILE_PERFORMANCE = 'performance'  # 読み書きの性能を優先
+SQLITE_PROFILES = {
+    SQLITE_PROFILE_DEFAULT: {},
+    SQLITE_PROFILE_PERFORMANCE: {
+        'journal_mode': 'WAL',  # 読み込みと書き込みが互いをブロックしないようにします。
+        'synchronous': 'NORMAL',  # WALの場合はNORMALでもDBが壊れることはありません。
+        'cache_size': -64 * 1024,  # ページキャッシュ（マイナスの場合はKiB単位）
+        'mmap_size': 256 * 1024 * 1024,  # メモリマップするサイズ（バイト）
+        'temp_store': 'MEMORY',  # 一時テーブルやインデックスをメモリ上に作成します。
+    },
+}
+SQLITE_PROFILE = SQLITE_PROFILE_PERFORMANCE  # 使用するプロファイル
+
+# 履歴データのテーブルを分割する方法を定義します。
+HISTORY_SHARDING_NONE = 'none'  # 分割しない（historyテーブルのみ）
+HISTORY_SHARDING_MARKET = 'market'  # マーケットごとに分割する（history_nyse, history_nasdaqなど）
+HISTORY_SHARDING_HASH = 'hash'  # シンボルのハッシュ値で分割する（history_00, history_01など）
+HISTORY_SHARDING = HISTORY_SHARDING_NONE  # 使用する分割方法
+HISTORY_NUM_HASH_SHARDS = 8  # ハッシュ値で分割する場合のテーブル数
+HISTORY_SHARD_FILES = False  # Trueにすると、分割したテーブルをそれぞれ別のDBファイルに保存します。
+
+# 読み込み専用の接続で、DBファイルを不変（immutable）として扱うかを定義します。
+# Trueにするとロックを取らなくなりますが、同時にupdate_dataを実行する場合はFalseにしてください。
+SQLITE_READONLY_IMMUTABLE = False
 
 # Logファイルのパスです。
 LOG_DIR = os.path.join(PRJ_DIR, 'logs')
@@ -72,12 +106,44 @@ MAX_SPAN = 365
 # CSVファイルのエンコーディングのデフォルトを定義します。
 DEFAULT_FILE_ENCODING = 'utf-8'
 
+# CSVファイルを読み込むときに、1回に読み込むサイズ（バイト）を定義します。
+CSV_READ_CHUNK_SIZE = 1024 * 1024
+
+# CSVファイルの行をまとめて取得するときに、1回に取得する行数のデフォルトを定義します。
+CSV_BATCH_SIZE = 10000
+
+# 履歴データのインポート時に、正常とみなす調整後の終値と調整前の終値の比率の範囲を定義します。
+HISTORY_VALID_RATE_RANGE = (0.0001, 10000)
+
+# 履歴データのキャッシュファイル（銘柄・カラムごとの.npy）がある場合に、DBの代わりに使うかを定義します。
+# キャッシュファイルはupdate_dataの--cacheオプションで作成します。
+USE_HISTORY_CACHE = False
+
+# build_panelで、履歴データを1回に取得する件数を定義します。
+HISTORY_PANEL_BATCH_SIZE = 100000
+
+# backtestで、履歴データを1回のクエリでまとめて取得する銘柄数を定義します。
+HISTORY_PREFETCH_SIZE = 100
+
 # 1回の仕掛けに使う資金量のデフォルトを定義します。
 DEFAULT_AMOUNT_PER_TRADE = 5000
 
 # indicatorをキャッシュする最大数
 MAX_INDICATOR_CACHES = 1000
 
+# indicatorのキャッシュに使う最大のバイト数
+MAX_INDICATOR_CACHE_BYTES = 512 * 1024 * 1024
+
+# indicatorのデータを.npyファイルとしてキャッシュし、次回以降の実行でも使うかを定義します。
+USE_INDICATOR_DISK_CACHE = True
+
+# indicatorのキャッシュファイルに使う最大のバイト数（超えた分は古いファイルから削除します。）
+MAX_INDICATOR_DISK_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# indicatorのデータの先頭に確保しておく、NaNで埋めた領域の件数です。
+# この件数以内であれば、過去にずらした配列（IndicatorBase.lagged）をコピーせずに取得できます。
+INDICATOR_LAG_PADDING = 5
+
 # ルールの種別
 RULE_TYPE_INDICATORS = 'indicators'
 RULE_TYPE_CONDITIONS = 'conditions'
@@ -2,7 +2,7 @@
 import logging
 from sqlalchemy.sql import func
 from ppyt.filters import FilterBase
-from ppyt.models.orm import start_session, History
+from ppyt.models.orm import start_session, get_history_class
 
 logger = logging.getLogger(__name__)
 
@@ -41,7 +41,9 @@ class AverageVolumeFilter(FilterBase):
 
         with start_session() as session:
             for s in stocks:
-                avg_volume = session.query(func.avg(History.volume)) \
+                # 履歴データのテーブルを分割している場合は、銘柄の履歴データがあるテーブルから集計します。
+                history_class = get_history_class(s.symbol, s.market_id)
+                avg_volume = session.query(func.avg(history_class.volume)) \
                     .filter_by(symbol=s.symbol).scalar()
 
                 logger.debug('symbol - avg_volume: {} - {}'.format(
@@ -1,10 +1,12 @@
 # coding: utf-8
 import logging
 import abc
+from collections import OrderedDict
 import numpy as np
 from ppyt import const
 from ppyt.mixins import FinderMixin, SingletonMixin
 from ppyt.exceptions import CommandError
+from ppyt.indicators.disk_cache import IndicatorDiskCache
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,7 @@ class IndicatorBase(FinderMixin, metaclass=abc.ABCMeta):
         self.__span = span
         self.__kwds = kwds
         self.__data = None
+        self.__buffer = None  # 先頭をNaNで埋めた、dataの元になる配列です。
 
     @abc.abstractmethod
     def _build_indicator(self, *args, **kwds):
@@ -56,19 +59,52 @@ class IndicatorBase(FinderMixin, metaclass=abc.ABCMeta):
         return self.__data
 
     def build(self):
-        """indicatorのデータを構築します。"""
+        """indicatorのデータを構築します。
+        キャッシュには先頭をNaNで埋めた配列を登録するので、ずらした配列もキャッシュから取得できます。
+        const.USE_INDICATOR_DISK_CACHEがTrueの場合は、キャッシュファイルも使います。
+        """
         instance = IndicatorCache.getinstance()
-        data = instance.get_data(klass=self.__class__, stock=self.stock,
-                                 span=self.__span, **self.__kwds)
-        if data is None:
-            # indicatorを組み立てます。
-            data = self._build_indicator(span=self.__span, **self.__kwds)
-            instance.add_data(data=data,
+        buffer = instance.get_data(klass=self.__class__, stock=self.stock,
+                                   span=self.__span, **self.__kwds)
+        if buffer is None:
+            key = None
+            if const.USE_INDICATOR_DISK_CACHE:
+                # メモリ上にない場合は、前回までの実行で作成したキャッシュファイルを探します。
+                key = instance.get_key(self.__class__, self.stock, span=self.__span, **self.__kwds)
+                if key is not None:
+                    buffer = IndicatorDiskCache.load(key)
+
+            if buffer is None:
+                # indicatorを組み立てます。
+                data = self._build_indicator(span=self.__span, **self.__kwds)
+                buffer = self.__to_lag_buffer(data)
+                if key is not None:
+                    IndicatorDiskCache.save(key, buffer)
+
+            instance.add_data(data=buffer,
                               klass=self.__class__,
                               stock=self.stock,
                               span=self.__span,
                               **self.__kwds)
-        self.__data = data
+        self.__buffer = buffer
+        self.__data = buffer[const.INDICATOR_LAG_PADDING:]
+
+    @staticmethod
+    def __to_lag_buffer(data):
+        """indicatorのデータの先頭に、const.INDICATOR_LAG_PADDING件分のNaNを追加した配列を生成します。
+        bool型の配列の場合は、NaNをboolに変換した値（True）で埋めます。
+
+        Args:
+            data: indicatorのデータ（numpyの配列）
+
+        Returns:
+            新しく生成したnumpyの配列
+        """
+        data = np.asarray(data)
+        buffer = np.empty((const.INDICATOR_LAG_PADDING + len(data), ) + data.shape[1:], dtype=data.dtype)
+        buffer[:const.INDICATOR_LAG_PADDING] = np.array(np.nan).astype(data.dtype)
+        buffer[const.INDICATOR_LAG_PADDING:] = data
+        return buffer
 
     def get(self, idx):
         """indicatorのデータを1日分取得します。
@@ -87,6 +123,20 @@ class IndicatorBase(FinderMixin, metaclass=abc.ABCMeta):
             raise NoDataError()  # numpy.nanは例外を投げます。
         return val
 
+    def rolled(self, func, price_type=const.PRICE_TYPE_CLOSE):
+        """span日分の価格を、ppyt.indicators.rollingの関数で集計した配列を取得します。
+        spanned_dataと違って2次元配列を作らないので、spanが大きくてもO(n)で計算できます。
+
+        Args:
+            func: rolling_meanやrolling_maxなどの関数
+            price_type: 参照する値段の種別（
+                open_price, high_price, low_price, close_price）
+
+        Returns:
+            新しく生成したnumpyの配列（先頭のspan-1件はNaN）
+        """
+        return func(self.stock.get_prices(price_type), self.__span)
+
     def spanned_data(self, price_type=const.PRICE_TYPE_CLOSE):
         """span日分のデータを集めたリストを取得します。
             例:
@@ -110,7 +160,7 @@ class IndicatorBase(FinderMixin, metaclass=abc.ABCMeta):
             raise CommandError('指定されたspan[{}]が最大値[{}]を超えています。'
                                .format(self.__span, const.MAX_SPAN))
 
-        data = [getattr(hist, price_type) for hist in self.stock.histories]
+        data = self.stock.get_prices(price_type)
 
         if len(data) < self.__span:
             # データが不足していて指標作成不能な場合はすべてnanで埋めた、
@@ -125,17 +175,54 @@ class IndicatorBase(FinderMixin, metaclass=abc.ABCMeta):
 
         # データが入る配列を作成します。
         data_arr = np.array([data[i: i + self.__span]
-                             for i in range(len(
-                                     self.stock.histories) - self.__span + 1)],
+                             for i in range(len(data) - self.__span + 1)],
                             dtype=np.float64)
         spanned_data = np.concatenate((nan_arr, data_arr), axis=0)
         logger.debug('spanned_data: {}'.format(spanned_data))
 
         return spanned_data
 
+    def lagged(self, lag):
+        """lag日分過去にずらした（i番目がi - lag日目の値になる）配列を取得します。
+        ※ずらしても配列のサイズは変更されません。先頭のlag件はNaNになります。
+        lagがconst.INDICATOR_LAG_PADDING以下の場合は、コピーせずに元の配列のビューを返します。
+        それより大きい場合はずらした配列をコピーして作り、IndicatorCacheにキャッシュします。
+
+        Args:
+            lag: ずらす日数（0以上）
+
+        Returns:
+            lag日分ずらした配列（読み込み専用として扱ってください。）
+        """
+        if lag < 0:
+            raise CommandError('lagには0以上の値を指定してください。lag: {}'.format(lag))
+
+        data = self.data
+        if lag <= const.INDICATOR_LAG_PADDING:
+            start = const.INDICATOR_LAG_PADDING - lag
+            return self.__buffer[start:start + len(data)]
+
+        # 同じindicator・lagの配列を何度もコピーしないように、キャッシュを使います。
+        # （_lagは、indicatorの引数と区別するためのキーです。）
+        instance = IndicatorCache.getinstance()
+        lagged = instance.get_data(klass=self.__class__, stock=self.stock,
+                                   span=self.__span, _lag=lag, **self.__kwds)
+        if lagged is None:
+            logger.debug('lag[{}]が大きいので、配列をコピーしてずらします。'.format(lag))
+            lagged = np.empty_like(data)
+            lagged[:lag] = np.array(np.nan).astype(data.dtype)
+            lagged[lag:] = data[:len(data) - lag]
+            instance.add_data(data=lagged, klass=self.__class__, stock=self.stock,
+                              span=self.__span, _lag=lag, **self.__kwds)
+        return lagged
+
     def shifted(self, num):
-        """左、または右方向にnum分ずらした配列を取得します。
+        """左、または右方向にnum分ずらした配列を取得します。新しく作成する場合はlaggedを使ってください。
         ※ずらしても配列のサイズは変更されません。新しく出現した場所にはNaNが入っています。
+        マイナスの場合はlagged(-num)と同じ配列を返します。
+        プラスの場合は、以前のバージョンとの互換性のために以前と同じ処理を行います。
+        （右側を埋めてから元のサイズに切り詰めるので、値はずれずに元の配列のコピーになります。）
+        プラスの指定は非推奨で、DeprecationWarningが発生します。
 
         Args:
             num: ずらす数（マイナスだと左、プラスだと右にずらす）
@@ -148,23 +235,33 @@ class IndicatorBase(FinderMixin, metaclass=abc.ABCMeta):
                                'NxNの配列までにしか対応していません。'.format(self.data.shape))
 
         if num < 0:
-            pad_width = (abs(num), 0)
-        elif num > 0:
-            pad_width = (0, num)
+            return self.lagged(-num)
 
+        import warnings
+        warnings.warn('shiftedにプラスの値を指定するのは非推奨です。laggedを使ってください。',
+                      DeprecationWarning, stacklevel=2)
+        pad_width = (0, num)
         if len(self.data.shape) == 2:
             pad_width = (pad_width, (0, 0))
 
-        return np.lib.pad(self.data, pad_width, 'constant',
-                          constant_values=(np.nan))[0:len(self.data)]
+        return np.pad(self.data, pad_width, 'constant',
+                      constant_values=(np.nan))[0:len(self.data)]
 
 
 class IndicatorCache(SingletonMixin):
-    """※マルチスレッドでの処理を考慮していないので、
+    """indicatorのデータを、最後に使った順（LRU）でキャッシュするクラスです。
+    件数（const.MAX_INDICATOR_CACHES）かバイト数（const.MAX_INDICATOR_CACHE_BYTES）の上限を超えると、
+    最も長く使われていないデータから削除します。
+    ※キャッシュファイルをメモリマップしたデータ（numpy.memmap）は、OSがページキャッシュとして管理し、
+    プロセスのメモリを消費しないので、バイト数には含めません。（件数には含めます。）
+    ※マルチスレッドでの処理を考慮していないので、
     スレッドセーフを実現していません。
     """
-    __cache = {}
-    __keys = []
+    __cache = OrderedDict()  # key: キャッシュのキー、value: indicatorのデータ
+    __nbytes = 0  # キャッシュしているデータの合計バイト数
+    num_hits = 0  # キャッシュから取得できた回数
+    num_misses = 0  # キャッシュになかった回数
+    num_evictions = 0  # 上限を超えたために削除した回数
 
     def get_key(self, klass, stock, **kwds):
         """キャッシュするときのキーを取得します。
@@ -174,20 +271,18 @@ class IndicatorCache(SingletonMixin):
             stock: 銘柄情報
 
         Returns:
-            キャッシュを一意に特定できるキー
+            キャッシュを一意に特定できるキー（tuple）
         """
-        def is_valid_kwvalue(v):
-            return v is None or type(v) in (bool, str, int, float)
-
         if stock is None or stock.symbol is None:
             return None
 
-        if any([not is_valid_kwvalue(v) for v in kwds.values()]):
-            return None
+        for v in kwds.values():
+            if v is not None and type(v) not in (bool, str, int, float):
+                return None
 
-        return '{}-symbol:{}-{}'.format(klass.__name__, stock.symbol,
-                                        '-'.join(['{}:{}'.format(k, v)
-                                                  for k, v in kwds.items()]))
+        # 同じ銘柄でも期間やデータのバージョンが異なるとデータが変わるので、それらもキーに含めます。
+        return (klass, stock.symbol, stock.data_version, stock.start_date, stock.end_date,
+                tuple(sorted(kwds.items())))
 
     def get_data(self, klass, stock, **kwds):
         """キャッシュからindicatorのデータを取得します。ヒットしない場合はNoneが返ります。
@@ -200,14 +295,16 @@ class IndicatorCache(SingletonMixin):
             キャッシュされていたindicatorのdata
         """
         key = self.get_key(klass, stock, **kwds)
-        logger.debug('key: {}'.format(key))
-
-        if key is None or key not in self.__cache:
-            logger.debug('key[{}]はキャッシュされていませんでした。'.format(key))
+        data = None if key is None else self.__cache.get(key)
+        if data is None:
+            self.__class__.num_misses += 1
+            logger.debug('key[%s]はキャッシュされていませんでした。', key)
             return None
 
-        logger.debug('key[{}]をキャッシュから取得します。'.format(key))
-        return self.__cache[key]
+        self.__cache.move_to_end(key)  # 最後に使ったデータにします。
+        self.__class__.num_hits += 1
+        logger.debug('key[%s]をキャッシュから取得します。', key)
+        return data
 
     def add_data(self, data, klass, stock, **kwds):
         """indicatorのデータをキャッシュします。
@@ -217,25 +314,46 @@ class IndicatorCache(SingletonMixin):
             klass: IndicatorBaseを継承したクラスオブジェクト
             stock: 銘柄情報
         """
-        from ppyt.const import MAX_INDICATOR_CACHES as MAX_CACHES
-        if MAX_CACHES == 0:
+        if const.MAX_INDICATOR_CACHES == 0 or const.MAX_INDICATOR_CACHE_BYTES == 0:
             logger.debug('キャッシュは無効になっています。')
             return
 
-        key = self.get_key(klass, stock, **kwds)
+        nbytes = self.__get_nbytes(data)
+        if nbytes > const.MAX_INDICATOR_CACHE_BYTES:
+            logger.debug('データが大きすぎるのでキャッシュしません。nbytes: %d', nbytes)
+            return
 
+        key = self.get_key(klass, stock, **kwds)
         if key is None:
             return
 
-        if key not in self.__cache and len(self.__keys) >= MAX_CACHES:
-            del_key = self.__keys.pop(0)
-            logger.debug('キャッシュが一杯なので、key[{}]で登録されたキャッシュを削除します。'
-                         .format(del_key))
-            del self.__cache[del_key]
-
+        cls = self.__class__
+        if key in self.__cache:
+            cls.__nbytes -= self.__get_nbytes(self.__cache[key])
         self.__cache[key] = data
-        logger.debug('key[{}]をキャッシュしました。'.format(key))
-        self.__keys.append(key)  # キーを登録しておきます。
+        self.__cache.move_to_end(key)
+        cls.__nbytes += nbytes
+        logger.debug('key[%s]をキャッシュしました。', key)
+
+        while len(self.__cache) > const.MAX_INDICATOR_CACHES \
+                or cls.__nbytes > const.MAX_INDICATOR_CACHE_BYTES:
+            # 最も長く使われていないデータを削除します。
+            del_key, del_data = self.__cache.popitem(last=False)
+            cls.__nbytes -= self.__get_nbytes(del_data)
+            cls.num_evictions += 1
+            logger.debug('キャッシュが一杯なので、key[%s]で登録されたキャッシュを削除します。', del_key)
+
+    @staticmethod
+    def __get_nbytes(data):
+        """上限と比較するデータのバイト数を取得します。メモリマップしたデータは0になります。"""
+        return 0 if isinstance(data, np.memmap) else data.nbytes
+
+    def get_summary(self):
+        """集計結果の文字列を取得します。"""
+        num_lookups = self.num_hits + self.num_misses
+        return 'ヒット: {:,d}回（{:.1f}%）, ミス: {:,d}回, 削除: {:,d}回, 件数: {:,d}件, 使用量: {:,.1f}MB'.format(
+            self.num_hits, 100.0 * self.num_hits / num_lookups if num_lookups else 0.0,
+            self.num_misses, self.num_evictions, len(self.__cache), self.__nbytes / 1024 / 1024)
 
 
 class IndicatorTemplate(IndicatorBase):
@@ -2,6 +2,7 @@
 import numpy as np
 from ppyt import const
 from ppyt.indicators import IndicatorBase
+from ppyt.indicators.rolling import rolling_mean, rolling_max, rolling_min
 
 
 class PriceIndicator(IndicatorBase):
@@ -18,7 +19,7 @@ class PriceIndicator(IndicatorBase):
         Returns:
             indicatorのデータ（numpyの配列）
         """
-        return np.array(self.stock.get_prices(price_type), dtype=np.float64)
+        return np.asarray(self.stock.get_prices(price_type), dtype=np.float64)
 
 
 class MovingAverageIndicator(IndicatorBase):
@@ -35,7 +36,7 @@ class MovingAverageIndicator(IndicatorBase):
         Returns:
             indicatorのデータ（numpyの配列）
         """
-        return np.average(self.spanned_data(price_type), axis=1)
+        return self.rolled(rolling_mean, price_type)
 
 
 class RecentHighPriceIndicator(IndicatorBase):
@@ -52,7 +53,7 @@ class RecentHighPriceIndicator(IndicatorBase):
         Returns:
             indicatorのデータ（numpyの配列）
         """
-        return np.max(self.spanned_data(price_type), axis=1)
+        return self.rolled(rolling_max, price_type)
 
 
 class RecentLowPriceIndicator(IndicatorBase):
@@ -67,4 +68,4 @@ class RecentLowPriceIndicator(IndicatorBase):
         Returns:
             indicatorのデータ（numpyの配列）
         """
-        return np.min(self.spanned_data(price_type), axis=1)
+        return self.rolled(rolling_min, price_type)
@@ -24,11 +24,11 @@ class CrossOverIndicator(IndicatorBase):
         ma_long = MovingAverageIndicator(stock=self.stock, span=span_long)
 
         if not reverse:  # 上に抜ける。
-            arr1 = ma_short.shifted(-2) < ma_long.shifted(-2)  # 一昨日を比較
-            arr2 = ma_short.shifted(-1) >= ma_long.shifted(-1)  # 昨日を比較
-            return np.logical_and(arr1, arr2)
+            arr1 = ma_short.lagged(2) < ma_long.lagged(2)  # 一昨日を比較
+            arr2 = ma_short.lagged(1) >= ma_long.lagged(1)  # 昨日を比較
+            return np.logical_and(arr1, arr2, out=arr1)
 
         else:  # 下に抜ける。
-            arr1 = ma_short.shifted(-2) > ma_long.shifted(-2)  # 一昨日を比較
-            arr2 = ma_short.shifted(-1) <= ma_long.shifted(-1)  # 昨日を比較
-            return np.logical_and(arr1, arr2)
+            arr1 = ma_short.lagged(2) > ma_long.lagged(2)  # 一昨日を比較
+            arr2 = ma_short.lagged(1) <= ma_long.lagged(1)  # 昨日を比較
+            return np.logical_and(arr1, arr2, out=arr1)
@@ -24,10 +24,11 @@ class UpperBreakoutIndicator(IndicatorBase):
         arr1 = indi.data
 
         # 1日過去にずらした配列を取得します。
-        arr2 = indi.shifted(-1)
+        arr2 = indi.lagged(1)
 
         # 前日は直近高値以下で、当日に直近高値を超えているかを判定します。
-        return np.logical_and(arr1, np.logical_not(arr2))
+        not_arr2 = np.logical_not(arr2)
+        return np.logical_and(arr1, not_arr2, out=not_arr2)
 
 
 class LowerBreakoutIndicator(IndicatorBase):
@@ -45,7 +46,8 @@ class LowerBreakoutIndicator(IndicatorBase):
         arr1 = indi.data
 
         # 1日過去にずらした配列を取得します。
-        arr2 = indi.shifted(-1)
+        arr2 = indi.lagged(1)
 
         # 前日は直近安値以上で、当日に直近安値未満かを判定します。
-        return np.logical_and(arr1, np.logical_not(arr2))
+        not_arr2 = np.logical_not(arr2)
+        return np.logical_and(arr1, not_arr2, out=not_arr2)
@@ -24,7 +24,7 @@ class CloseGtRecentHighIndicator(IndicatorBase):
         price_indicator = PriceIndicator(stock=self.stock,
                                          price_type=const.PRICE_TYPE_CLOSE)
 
-        arr1 = recent_indicator.shifted(-1)  # 昨日
+        arr1 = recent_indicator.lagged(1)  # 昨日
         arr2 = price_indicator.data  # 当日
 
         # 昨日の終値が一昨日のX日間高値を上回っているかを判定します。
@@ -46,7 +46,7 @@ class CloseLtRecentLowIndicator(IndicatorBase):
         price_indicator = PriceIndicator(stock=self.stock,
                                          price_type=const.PRICE_TYPE_CLOSE)
 
-        arr1 = recent_indicator.shifted(-1)  # 昨日
+        arr1 = recent_indicator.lagged(1)  # 昨日
         arr2 = price_indicator.data  # 当日
 
         # 昨日の終値が一昨日のX日間安値を下回っているかを判定します。
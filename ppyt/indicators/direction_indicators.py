@@ -4,10 +4,43 @@ import numpy as np
 from ppyt.indicators import IndicatorBase
 from ppyt.indicators.basic_indicators import MovingAverageIndicator
 from ppyt import const
+from ppyt.exceptions import CommandError
+from ppyt.finders import SimpleFinder
 
 logger = logging.getLogger(__name__)
 
 
+def get_directions(data, bars=1):
+    """bars日前の値と比べた向き（const.INDI_DIRECTION_XXX）の配列を取得します。
+    ループを使わず、配列同士の差分でまとめて判定します。
+    先頭のbars件や、比較するどちらかの値がNaNの場合はNaNになります。
+
+    Args:
+        data: indicatorのデータ（numpyの配列）
+        bars: 何日前の値と比べるか
+
+    Returns:
+        向きの配列（float64）
+
+    Raises:
+        CommandError: barsが不正な場合に発生します。
+    """
+    if not isinstance(bars, int) or bars < 1:
+        raise CommandError('barsには1以上の整数を指定してください。bars: {}'.format(bars))
+
+    data = np.asarray(data, dtype=np.float64)
+    directions = np.full(len(data), np.nan, dtype=np.float64)
+    if len(data) <= bars:
+        return directions
+
+    diff = data[bars:] - data[:-bars]
+    directions[bars:] = np.select([diff > 0, diff < 0],
+                                  [const.INDI_DIRECTION_UP, const.INDI_DIRECTION_DOWN],
+                                  const.INDI_DIRECTION_HR)  # 上向き、下向き、水平
+    directions[bars:][np.isnan(diff)] = np.nan
+    return directions
+
+
 class MADirectionIndicator(IndicatorBase):
     """移動平均線の向きを表す指標です。"""
     _findkey = '移動平均線の向き'
@@ -18,18 +51,31 @@ class MADirectionIndicator(IndicatorBase):
         Args:
             span: 移動平均線の集計日数
         """
-        def get_direction(val1, val2):
-            if np.isnan(val1) or np.isnan(val1):
-                return np.nan
-            elif val1 < val2:
-                return const.INDI_DIRECTION_UP  # 上向き
-            elif val1 > val2:
-                return const.INDI_DIRECTION_DOWN  # 下向き
-            else:
-                return const.INDI_DIRECTION_HR  # 水平
-
         ma = MovingAverageIndicator(stock=self.stock, span=span)
-        arr1 = ma.shifted(-1)  # 一日前の移動平均の配列
-        arr2 = ma.data  # 移動平均の配列
-        return np.array([get_direction(a, b) for a, b
-                         in zip(arr1, arr2)], dtype=np.float16)
+        return get_directions(ma.data)  # 一日前の移動平均と比べた向きです。
+
+
+class IndicatorDirectionIndicator(IndicatorBase):
+    """任意の指標の、bars日前と比べた向きを表す指標です。
+        例: 指標の向き indicator=直近高値 bars=5 span=20
+    """
+    _findkey = '指標の向き'
+
+    def _build_indicator(self, indicator, bars=1, span=None, **kwds):
+        """indicatorのデータを組み立てます。
+
+        Args:
+            indicator: 向きを判定する指標のfindkey
+            bars: 何日前の値と比べるか
+            span: 向きを判定する指標に渡すspan
+            kwds: 向きを判定する指標に渡すその他の引数
+
+        Raises:
+            CommandError: 指標が見つからない場合に発生します。
+        """
+        klass = SimpleFinder.getinstance().find_class(const.RULE_TYPE_INDICATORS, indicator)
+        if klass is None:
+            raise CommandError('findkey[{}]に一致する指標が見つかりませんでした。'.format(indicator))
+
+        target = klass(stock=self.stock, span=span, **kwds)
+        return get_directions(target.data, bars)
@@ -0,0 +1,173 @@
+# coding: utf-8
+import logging
+import hashlib
+import os
+import numpy as np
+from ppyt import const
+
+logger = logging.getLogger(__name__)
+
+
+class IndicatorDiskCache(object):
+    """indicatorのデータを.npyファイルとしてキャッシュするクラスです。IndicatorCacheの2段目として使います。
+    ファイル名はIndicatorCacheのキー（クラス、銘柄、データのバージョン、期間、引数）とDBのID、
+    indicatorの計算に関わるソースコードから作ったハッシュ値なので、データやコードが変わると別のファイルになります。
+    読み込み時はメモリマップするので、次回以降の実行では指標を計算せずにすぐ取得できます。
+    ※書き込みは一時ファイルに書き出してから置き換えるので、同時に読み込むプロセスが
+    書きかけのファイルを読むことはありません。
+    """
+
+    num_hits = 0  # キャッシュファイルから読み込めた回数
+    num_misses = 0  # キャッシュファイルがなかった回数
+    num_saves = 0  # キャッシュファイルを作成した回数
+    __code_version = None  # indicatorの計算に関わるソースコードのバージョン
+    __db_id = None  # DBのID（Setting.KEY_DB_ID、未登録の場合は空文字）
+
+    # indicatorの計算に関わるソースコードのパス（ppytパッケージからの相対パス）です。
+    # 価格の取得方法や定数を変更した場合も、古いキャッシュが使われないようにします。
+    SOURCE_PATHS = ('indicators', 'models', 'const.py')
+
+    @classmethod
+    def get_filepath(cls, key):
+        """キャッシュファイルのパスを取得します。
+
+        Args:
+            key: IndicatorCache.get_keyで取得したキー
+
+        Returns:
+            ファイルのパス（DBのIDが未登録の場合は、別のDBのキャッシュと区別できないのでNone）
+        """
+        if cls.__db_id is None:
+            from ppyt.models.orm import Setting
+            cls.__db_id = Setting.get_db_id() or ''
+        if cls.__db_id == '':
+            return None
+
+        digest = hashlib.sha1(repr((cls.__get_code_version(), cls.__db_id, key))
+                              .encode('utf-8')).hexdigest()
+        # 1つのディレクトリにファイルが集中しないように、ハッシュ値の先頭2文字で分けます。
+        return os.path.join(const.INDICATOR_CACHE_DIR, digest[:2], digest + '.npy')
+
+    @classmethod
+    def load(cls, key):
+        """キャッシュファイルをメモリマップして読み込みます。
+
+        Args:
+            key: IndicatorCache.get_keyで取得したキー
+
+        Returns:
+            indicatorのデータ（キャッシュがない、または壊れている場合はNone）
+        """
+        filepath = cls.get_filepath(key)
+        if filepath is None:
+            cls.num_misses += 1
+            return None
+
+        try:
+            data = np.load(filepath, mmap_mode='r')
+        except (OSError, ValueError):
+            cls.num_misses += 1
+            return None
+
+        try:
+            os.utime(filepath)  # 古いファイルから削除できるように、使った日時を更新します。
+        except OSError:
+            pass
+        cls.num_hits += 1
+        logger.debug('key[%s]をキャッシュファイルから取得します。', key)
+        return data
+
+    @classmethod
+    def save(cls, key, data):
+        """キャッシュファイルを作成します。既にある場合は置き換えます。
+
+        Args:
+            key: IndicatorCache.get_keyで取得したキー
+            data: indicatorのデータ（numpyの配列）
+        """
+        if data.dtype.kind not in 'biuf' or data.size == 0:
+            # 数値以外の配列と空の配列（メモリマップできない）はキャッシュしません。
+            return
+
+        filepath = cls.get_filepath(key)
+        if filepath is None:
+            return
+
+        tmp_filepath = '{}.tmp.{}'.format(filepath, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(tmp_filepath, 'wb') as f:
+                np.save(f, np.ascontiguousarray(data), allow_pickle=False)
+            os.replace(tmp_filepath, filepath)
+        except OSError as e:
+            logger.warning('indicatorのキャッシュファイルを作成できませんでした。原因: {}'.format(e))
+            return
+
+        cls.num_saves += 1
+        logger.debug('key[%s]をキャッシュファイルに保存しました。', key)
+
+    @classmethod
+    def evict(cls, max_bytes=None):
+        """キャッシュファイルの合計サイズが上限を超えている場合に、最後に使った日時が古いものから削除します。
+
+        Args:
+            max_bytes: キャッシュファイルの合計サイズの上限（Noneの場合はconst.MAX_INDICATOR_DISK_CACHE_BYTES）
+
+        Returns:
+            削除したファイルの数
+        """
+        if max_bytes is None:
+            max_bytes = const.MAX_INDICATOR_DISK_CACHE_BYTES
+
+        files = []
+        for dirpath, _, filenames in os.walk(const.INDICATOR_CACHE_DIR):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(filepath)
+                except FileNotFoundError:
+                    continue  # 他のプロセスが削除した場合は飛ばします。
+                files.append((st.st_mtime, st.st_size, filepath))
+
+        total_bytes = sum(size for _, size, _ in files)
+        num_removes = 0
+        for _, size, filepath in sorted(files):
+            if total_bytes <= max_bytes:
+                break
+            try:
+                # 読み込み中のプロセスがあっても、メモリマップした内容はそのまま読めます。
+                os.remove(filepath)
+                num_removes += 1
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+        if num_removes > 0:
+            logger.debug('indicatorのキャッシュファイルを{:,d}件削除しました。'.format(num_removes))
+        return num_removes
+
+    @classmethod
+    def get_summary(cls):
+        """集計結果の文字列を取得します。"""
+        return 'ヒット: {:,d}回, ミス: {:,d}回, 作成: {:,d}件'.format(
+            cls.num_hits, cls.num_misses, cls.num_saves)
+
+    @classmethod
+    def __get_code_version(cls):
+        """indicatorの計算に関わるソースコード（SOURCE_PATHS以下の.pyファイル）のバージョンを取得します。
+        ファイルの更新日時とサイズから作るので、指標の計算方法を変更すると古いキャッシュは使われなくなります。
+        """
+        if cls.__code_version is None:
+            package_dirpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            stats = []
+            for path in cls.SOURCE_PATHS:
+                path = os.path.join(package_dirpath, path)
+                filepaths = [path] if os.path.isfile(path) else \
+                    [os.path.join(path, fn) for fn in sorted(os.listdir(path))]
+                for filepath in filepaths:
+                    if filepath.endswith('.py'):
+                        st = os.stat(filepath)
+                        stats.append((os.path.relpath(filepath, package_dirpath),
+                                      st.st_mtime_ns, st.st_size))
+            cls.__code_version = hashlib.sha1(repr(stats).encode('utf-8')).hexdigest()
+        return cls.__code_version
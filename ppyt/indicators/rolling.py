@@ -0,0 +1,185 @@
+# coding: utf-8
+import logging
+import numpy as np
+from ppyt.exceptions import CommandError
+
+logger = logging.getLogger(__name__)
+
+
+def rolling_sum(values, span):
+    """span日分の合計を、span件ずつのブロックごとの累積和で計算します。
+    計算量は配列の長さnに対してO(n)で、spanの大きさには依存しません。
+    累積和はブロックごとに0から始めるので、配列全体の累積和の差分と違って丸め誤差が蓄積しません。
+    先頭のspan-1件（データ数がspanに満たない場合はすべて）はNaNになります。
+    また、期間内にNaNが含まれる場合もNaNになります。
+
+    Args:
+        values: 値の配列
+        span: 集計期間
+
+    Returns:
+        合計の配列（float64）
+    """
+    values, result = _prepare(values, span)
+    n = len(values)
+    if n < span:
+        return result
+
+    nan_mask = np.isnan(values)
+    prefix, suffix = _block_accumulate(np.where(nan_mask, 0.0, values), span, np.add, 0.0)
+
+    # 期間[i - span + 1, i]の合計は、開始位置の後ろからの累積と終了位置の前からの累積の和です。
+    # ただし、開始位置がブロックの先頭の場合は、終了位置の前からの累積だけで期間全体になります。
+    starts = np.arange(n - span + 1)
+    result[span - 1:] = np.where(starts % span == 0, prefix[span - 1:],
+                                 suffix[:n - span + 1] + prefix[span - 1:])
+    if nan_mask.any():
+        result[span - 1:][_window_counts(nan_mask, span) > 0] = np.nan
+    return result
+
+
+def rolling_count(mask, span):
+    """span日分のうち、Trueの件数を計算します。
+
+    Args:
+        mask: boolの配列
+        span: 集計期間
+
+    Returns:
+        件数の配列（float64、先頭のspan-1件はNaN）
+    """
+    mask, result = _prepare(mask, span, dtype=bool)
+    if len(mask) >= span:
+        result[span - 1:] = _window_counts(mask, span)
+    return result
+
+
+def rolling_mean(values, span):
+    """span日分の平均（移動平均）を計算します。
+    期間内の値がすべて同じ場合は、丸め誤差が出ないようにその値をそのまま平均にします。
+    （値動きのない期間で、移動平均の向きが水平にならなくなるのを防ぎます。）
+
+    Args:
+        values: 値の配列
+        span: 集計期間
+
+    Returns:
+        平均の配列（float64、先頭のspan-1件はNaN）
+    """
+    means = rolling_sum(values, span) / span
+    highs = rolling_max(values, span)
+    flat = highs == rolling_min(values, span)
+    means[flat] = highs[flat]
+    return means
+
+
+def rolling_max(values, span):
+    """span日分の最大値を計算します。詳細は_rolling_extremumを参照してください。
+
+    Args:
+        values: 値の配列
+        span: 集計期間
+
+    Returns:
+        最大値の配列（float64、先頭のspan-1件はNaN）
+    """
+    return _rolling_extremum(values, span, np.maximum, -np.inf)
+
+
+def rolling_min(values, span):
+    """span日分の最小値を計算します。詳細は_rolling_extremumを参照してください。
+
+    Args:
+        values: 値の配列
+        span: 集計期間
+
+    Returns:
+        最小値の配列（float64、先頭のspan-1件はNaN）
+    """
+    return _rolling_extremum(values, span, np.minimum, np.inf)
+
+
+def _rolling_extremum(values, span, ufunc, fill_value):
+    """span日分の最大値、または最小値をO(n)で計算します。
+    配列をspan件ずつのブロックに分けて、ブロック内の前からの累積と後ろからの累積を求めておくと、
+    どの期間もあるブロックの後半とその次のブロックの前半に分かれるので、2つの累積の比較だけで求まります。
+    （van Herk/Gil-Wermanのアルゴリズム。Pythonのループを使わずにnumpyだけで計算できます。）
+
+    Args:
+        values: 値の配列
+        span: 集計期間
+        ufunc: numpy.maximum、またはnumpy.minimum
+        fill_value: 末尾のブロックを埋める値（結果に影響しない値）
+
+    Returns:
+        集計結果の配列（float64、先頭のspan-1件はNaN）
+    """
+    values, result = _prepare(values, span)
+    n = len(values)
+    if n < span:
+        return result
+
+    prefix, suffix = _block_accumulate(values, span, ufunc, fill_value)
+
+    # 期間[i - span + 1, i]の値は、開始位置の後ろからの累積と終了位置の前からの累積から求まります。
+    result[span - 1:] = ufunc(suffix[:n - span + 1], prefix[span - 1:])
+    return result
+
+
+def _block_accumulate(values, span, ufunc, fill_value):
+    """配列をspan件ずつのブロックに分けて、ブロック内の前からの累積と後ろからの累積を計算します。
+
+    Args:
+        values: 値の配列
+        span: ブロックの件数
+        ufunc: 累積に使うnumpyのufunc（numpy.add、numpy.maximumなど）
+        fill_value: 末尾のブロックを埋める値（結果に影響しない値）
+
+    Returns:
+        (前からの累積の配列, 後ろからの累積の配列)のtuple（長さはどちらもlen(values)）
+    """
+    n = len(values)
+    num_blocks = -(-n // span)
+    padded = np.full(num_blocks * span, fill_value, dtype=np.float64)
+    padded[:n] = values
+    blocks = padded.reshape(num_blocks, span)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()[:n]
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()[:n]
+    return prefix, suffix
+
+
+def _prepare(values, span, dtype=np.float64):
+    """引数をチェックして、入力の配列と結果を格納するNaNの配列を用意します。
+
+    Args:
+        values: 値の配列
+        span: 集計期間
+        dtype: 入力の配列の型
+
+    Returns:
+        (入力の配列, 結果を格納する配列)のtuple
+
+    Raises:
+        CommandError: spanが不正な場合に発生します。
+    """
+    if span is None:
+        raise CommandError('spanが指定されていません。')
+    if span < 1:
+        raise CommandError('spanには1以上の値を指定してください。span: {}'.format(span))
+
+    values = np.asarray(values, dtype=dtype)
+    return values, np.full(len(values), np.nan, dtype=np.float64)
+
+
+def _window_counts(mask, span):
+    """期間に含まれるTrueの件数を、先頭の期間から順に計算します。
+
+    Args:
+        mask: boolの配列（長さはspan以上）
+        span: 集計期間
+
+    Returns:
+        件数の配列（長さはlen(mask) - span + 1）
+    """
+    cumsum = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return cumsum[span:] - cumsum[:-span]
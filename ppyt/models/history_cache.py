@@ -0,0 +1,177 @@
+# coding: utf-8
+import logging
+import os
+import shutil
+import time
+from urllib.parse import quote
+import numpy as np
+from ppyt import const
+from ppyt.models.series import HistorySeries
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryCache(object):
+    """履歴データを銘柄ごとにnumpyのバイナリファイル（.npy）としてキャッシュするクラスです。
+    キャッシュは読み込み時にメモリマップするので、SQLやORMの処理が不要になり、
+    複数のプロセスで同じ銘柄を読み込む場合もOSのページキャッシュを共有できます。
+    銘柄のディレクトリには、作成するたびに別のバージョンのディレクトリを作り、
+    どのバージョンを使うかをCURRENTファイルに書きます。CURRENTファイルはos.replaceで置き換えるので、
+    読み込み中のプロセスがキャッシュを見失ったり、新旧のカラムを混ぜて読んだりすることはありません。
+    ※正となるデータはSQLiteのhistoryテーブルです。update_dataで履歴データが更新された銘柄の
+    キャッシュは、作り直されるか削除されます。
+    また、CURRENTファイルには作成元のDBのIDと銘柄のdata_versionも書いておき、読み込み時に一致しない場合は
+    キャッシュを使いません。（DBを作り直したり、差し替えたりした場合に、古いデータを使わないようにします。）
+    """
+
+    CURRENT_FILENAME = 'CURRENT'  # 使用するバージョンのディレクトリ名を書いたファイルの名前
+    MAX_LOAD_RETRIES = 3  # 読み込み中にバージョンが切り替わった場合に、読み込み直す回数
+    __db_id = None  # DBのID（Setting.KEY_DB_ID、未登録の場合は空文字）
+
+    @classmethod
+    def get_db_id(cls):
+        """キャッシュの作成元として記録する、DBのIDを取得します。
+
+        Returns:
+            DBのID（未登録の場合はNone）
+        """
+        if cls.__db_id is None:
+            from ppyt.models.orm import Setting
+            cls.__db_id = Setting.get_db_id() or ''
+        return cls.__db_id or None
+
+    @classmethod
+    def get_dirpath(cls, symbol):
+        """銘柄のキャッシュファイルを置くディレクトリのパスを取得します。
+
+        Args:
+            symbol: 銘柄のシンボル
+
+        Returns:
+            ディレクトリのパス（シンボルに含まれる/などはエスケープされます。）
+        """
+        return os.path.join(const.HISTORY_CACHE_DIR, quote(symbol, safe=''))
+
+    @classmethod
+    def load(cls, symbol, data_version):
+        """銘柄のキャッシュファイルをメモリマップして読み込みます。
+
+        Args:
+            symbol: 銘柄のシンボル
+            data_version: 銘柄の現在のdata_version（Stock.data_version）
+
+        Returns:
+            HistorySeriesのインスタンス（キャッシュがない、壊れている、またはDBのデータと
+            作成元が異なる場合はNone）
+        """
+        dirpath = cls.get_dirpath(symbol)
+        expected = (cls.get_db_id(), str(data_version))
+        arrays, version = None, None
+        for _ in range(cls.MAX_LOAD_RETRIES):
+            try:
+                # 先にバージョンを決めてから、そのバージョンのファイルだけを読み込みます。
+                with open(os.path.join(dirpath, cls.CURRENT_FILENAME)) as f:
+                    lines = f.read().split()
+                last_version, version = version, lines[0] if lines else ''
+                if version == last_version:
+                    break  # バージョンが切り替わっていない場合は、読み込み直しても同じです。
+
+                if expected[0] is None or tuple(lines[1:]) != expected:
+                    logger.debug('銘柄[{}]のキャッシュは、別のDB、または古いデータから作成されています。'
+                                 .format(symbol))
+                    arrays = None
+                    break
+
+                version_dirpath = os.path.join(dirpath, version)
+                arrays = [np.load(os.path.join(version_dirpath, column + '.npy'), mmap_mode='r')
+                          for column in HistorySeries.COLUMNS]
+                break
+            except (OSError, ValueError) as e:
+                # 読み込み中に古いバージョンが削除された場合は、新しいバージョンで読み込み直します。
+                logger.debug('銘柄[{}]のキャッシュを読み込めませんでした。原因: {}'.format(symbol, e))
+                arrays = None
+                if isinstance(e, FileNotFoundError) and version is None:
+                    break  # キャッシュがありません。
+
+        if arrays is None:
+            return None
+
+        if len(set(len(arr) for arr in arrays)) != 1:
+            logger.debug('銘柄[{}]のキャッシュの件数が揃っていません。'.format(symbol))
+            return None
+
+        return HistorySeries(*arrays)
+
+    @classmethod
+    def save(cls, symbol, series, data_version):
+        """銘柄のキャッシュファイルを作成します。既にある場合は置き換えます。
+        新しいバージョンのディレクトリに書き出してから、CURRENTファイルを置き換えて切り替えます。
+
+        Args:
+            symbol: 銘柄のシンボル
+            series: キャッシュするHistorySeries
+            data_version: seriesを取得した時点の、銘柄のdata_version（Stock.data_version）
+        """
+        db_id = cls.get_db_id()
+        if len(series) == 0 or db_id is None:
+            # 空の配列はメモリマップできないので、キャッシュを作成しません。
+            # また、DBのIDがない場合は作成元を区別できないので、キャッシュを作成しません。
+            cls.invalidate(symbol)
+            return
+
+        dirpath = cls.get_dirpath(symbol)
+        version = 'v{}.{}'.format(time.time_ns(), os.getpid())
+        version_dirpath = os.path.join(dirpath, version)
+        os.makedirs(version_dirpath)
+        for column, arr in zip(HistorySeries.COLUMNS, series.arrays):
+            np.save(os.path.join(version_dirpath, column + '.npy'), np.ascontiguousarray(arr))
+
+        current_filepath = os.path.join(dirpath, cls.CURRENT_FILENAME)
+        tmp_filepath = '{}.tmp.{}'.format(current_filepath, os.getpid())
+        with open(tmp_filepath, 'w') as f:
+            # バージョンのディレクトリ名、作成元のDBのID、data_versionを1行ずつ書きます。
+            f.write('\n'.join([version, db_id, str(data_version)]))
+        os.replace(tmp_filepath, current_filepath)
+
+        # 古いバージョンを削除します。読み込み中のプロセスは、メモリマップした内容をそのまま読めます。
+        for name in os.listdir(dirpath):
+            if name not in (version, cls.CURRENT_FILENAME):
+                cls.__remove(os.path.join(dirpath, name))
+        logger.debug('銘柄[{}]のキャッシュを作成しました。'.format(symbol))
+
+    @classmethod
+    def invalidate(cls, symbol):
+        """銘柄のキャッシュファイルを削除します。
+
+        Args:
+            symbol: 銘柄のシンボル
+        """
+        dirpath = cls.get_dirpath(symbol)
+        if not os.path.isdir(dirpath):
+            return
+
+        # 先にCURRENTファイルを削除して、以降の読み込みでキャッシュを使わないようにします。
+        try:
+            os.remove(os.path.join(dirpath, cls.CURRENT_FILENAME))
+        except FileNotFoundError:
+            pass
+
+        old_dirpath = '{}.old.{}'.format(dirpath, os.getpid())
+        os.rename(dirpath, old_dirpath)
+        shutil.rmtree(old_dirpath)
+        logger.debug('銘柄[{}]のキャッシュを削除しました。'.format(symbol))
+
+    @staticmethod
+    def __remove(path):
+        """ファイル、またはディレクトリを削除します。
+
+        Args:
+            path: 削除するパス
+        """
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
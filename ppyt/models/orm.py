@@ -1,25 +1,226 @@
 # coding: utf-8
 import logging
-from contextlib import contextmanager
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
 from sqlalchemy import (
     create_engine, event, Column, Integer, String,
     Float, Date, DateTime, SmallInteger, Boolean,
-    ForeignKeyConstraint
+    ForeignKeyConstraint, Index
 )
 from sqlalchemy.engine import Engine
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import sessionmaker, reconstructor
 from ppyt import const
 from ppyt.exceptions import CommandError
 from ppyt.decorators import cached_property
+from ppyt.models.history_cache import HistoryCache
+from ppyt.models.series import HistorySeries
 from ppyt.utils import str_to_number
 
 logger = logging.getLogger(__name__)
 Base = declarative_base()
 engine = create_engine(const.DSN, echo=False)
+readonly_engine = None  # use_readonly_connectionを呼ぶと設定されます。
 Session = sessionmaker(bind=engine, autocommit=False)
 DEFINED_TABLE_CLASSES = {}
+_shared = None  # start_command_scopeの実行中に、共有するセッションとコネクションを保持します。
+
+
+class DBStats(object):
+    """DBへのアクセス回数を集計するクラスです。コマンドの終了時にログに出力します。"""
+    num_sessions = 0  # 生成したセッションの数
+    num_connections = 0  # 取得したコネクションの数
+    num_reuses = 0  # start_command_scopeのセッション・コネクションを再利用した回数
+    num_queries = 0  # 実行したSQLの数
+
+    @classmethod
+    def count_query(cls, statement):
+        """SQLの実行回数を数えます。sqlite3のset_trace_callbackに登録して使います。"""
+        cls.num_queries += 1
+
+    @classmethod
+    def get_summary(cls):
+        """集計結果の文字列を取得します。"""
+        return 'セッション: {:,d}回, コネクション: {:,d}回, 再利用: {:,d}回, SQL: {:,d}件'.format(
+            cls.num_sessions, cls.num_connections, cls.num_reuses, cls.num_queries)
+
+
+def use_readonly_connection(immutable=const.SQLITE_READONLY_IMMUTABLE):
+    """commitしないセッション・コネクションを、読み込み専用の接続に切り替えます。
+    DBに書き込まないコマンドで使うと、update_dataと同時に実行してもロックを待たなくなります。
+    ※commit=Trueで開始したセッション・コネクションは、引き続き通常の接続を使います。
+
+    Args:
+        immutable: TrueにするとDBファイルを不変として扱い、ロックを一切取らなくなります。
+            実行中にDBが更新される可能性がある場合はFalseにしてください。
+    """
+    import sqlite3
+    global readonly_engine
+    uri = 'file:{}?{}'.format(const.DB_PATH, 'immutable=1' if immutable else 'mode=ro')
+
+    def connect():
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    readonly_engine = create_engine('sqlite://', creator=connect, echo=False)
+    logger.debug('読み込み専用の接続に切り替えました。uri: {}'.format(uri))
+
+
+def use_memory_snapshot():
+    """commitしないセッション・コネクションを、DBファイルをメモリ上に複製したDBへの接続に切り替えます。
+    sqlite3のバックアップAPIで起動時に1回だけ複製するので、以降の読み込みでディスクにアクセスしなくなります。
+    ※commit=Trueで開始したセッション・コネクションは、引き続きDBファイルに接続します。
+      そのため、書き込んだ内容はメモリ上のDBには反映されません。
+    """
+    import sqlite3
+    from sqlalchemy.pool import StaticPool
+    global readonly_engine
+    if const.HISTORY_SHARD_FILES:
+        raise CommandError('履歴データを別のDBファイルに分割している場合は、メモリ上に複製できません。')
+
+    memory_conn = sqlite3.connect(':memory:', check_same_thread=False)
+    source_conn = sqlite3.connect('file:{}?mode=ro'.format(const.DB_PATH), uri=True)
+    try:
+        source_conn.backup(memory_conn)
+    finally:
+        source_conn.close()
+    memory_conn.execute('PRAGMA query_only = ON')
+
+    # メモリ上のDBは接続ごとに別のDBになるので、1つのコネクションを使い回します。
+    readonly_engine = create_engine('sqlite://', creator=lambda: memory_conn,
+                                    poolclass=StaticPool, echo=False)
+    logger.debug('メモリ上に複製したDBへの接続に切り替えました。')
+
+
+def is_schema_outdated():
+    """DBのスキーマがmigrate_dbコマンドによる変更前の状態かを判定します。
+    stockテーブルのカラム、historyテーブルの定義（WITHOUT ROWID）、インデックス、
+    年次のファイナンシャルデータの形式、分割したテーブルへの履歴データの移動を確認します。
+
+    Returns:
+        migrate_dbコマンドを実行する必要がある場合はTrue
+    """
+    with start_raw_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA table_info({})'.format(Stock.__tablename__))
+        columns = [row[1] for row in cursor.fetchall()]
+        if any(c not in columns for c in ('symbol_lower', 'data_version')):
+            return True
+
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                       (History.__tablename__, ))
+        row = cursor.fetchone()
+        if row is None or 'WITHOUT ROWID' not in row[0].upper():
+            return True
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        index_names = set(row[0] for row in cursor.fetchall())
+        if any(index.name not in index_names
+               for table in (Stock.__table__, FinancialData.__table__) for index in table.indexes):
+            return True
+
+        # 以前の形式（quarter = ''）で保存した年次のファイナンシャルデータが残っていないかを確認します。
+        cursor.execute("SELECT 1 FROM {} WHERE quarter = '' LIMIT 1".format(FinancialData.__tablename__))
+        if cursor.fetchone() is not None:
+            return True
+
+        if get_history_classes() != [History]:
+            # 分割している場合は、historyテーブルに履歴データが残っていないかを確認します。
+            cursor.execute('SELECT 1 FROM {} LIMIT 1'.format(History.__tablename__))
+            if cursor.fetchone() is not None:
+                return True
+
+        return False
+
+
+def get_engine(commit=False):
+    """セッション・コネクションの開始に使うEngineを取得します。
+
+    Args:
+        commit: Trueの場合は書き込み可能なEngineを返します。
+
+    Returns:
+        SQLAlchemyのEngine
+    """
+    if commit or readonly_engine is None:
+        return engine
+    return readonly_engine
+
+
+@contextmanager
+def start_command_scope():
+    """コマンドの実行中に、1つのコネクションとセッションを共有するスコープを開始します。
+    スコープ内でcommit=Falseのstart_session, start_raw_connectionを呼ぶと、
+    新しく接続せずに共有しているセッション・コネクションを返します。
+    WALモードの場合は、開始時に読み込みのトランザクションを明示的に開始するので、
+    スコープ内では同じ時点のデータを参照します。（WALモードでは読み込みが書き込みをブロックしません。）
+    WALモード以外では、読み込みのトランザクションを持ち続けると他の接続の書き込みが
+    "database is locked"で失敗するので、トランザクションは開始しません。
+    ※commit=Trueのセッション・コネクションは、スコープ内でも個別に接続します。
+    その間は読み込みのトランザクションを終了し、書き込み後に開始し直します。
+    ※WALモードでは、読み込みのトランザクションが開始した時点より後の書き込みを、
+    チェックポイントでDBファイルに反映できません。backtestのように長時間実行するコマンドは、
+    区切りのよいところでrefresh_command_snapshotを呼んで、トランザクションを開始し直してください。
+    （同時にupdate_dataを実行した場合に、-walファイルが大きくなり続けるのを防ぎます。）
+
+    Usage:
+        with start_command_scope():
+            with start_session() as session:
+                ...
+    """
+    global _shared
+    if _shared is not None:
+        raise CommandError('start_command_scopeは入れ子にできません。')
+
+    connection = get_engine().connect()
+    DBStats.num_connections += 1
+    session = None
+    try:
+        raw_conn = connection.connection
+        cursor = raw_conn.cursor()
+        cursor.execute('PRAGMA journal_mode')
+        if cursor.fetchone()[0].lower() == 'wal':
+            cursor.execute('BEGIN')  # 読み込みのトランザクションを開始します。
+        session = Session(bind=connection)
+        DBStats.num_sessions += 1
+        _shared = (session, raw_conn)
+        yield
+    finally:
+        _shared = None
+        if session is not None:
+            session.close()
+        connection.connection.rollback()  # 読み込みのトランザクションを終了します。
+        connection.close()
+
+
+@contextmanager
+def _pause_command_scope():
+    """start_command_scopeの読み込みのトランザクションを一時的に終了します。
+    commit=Trueのセッション・コネクションで書き込む間に使います。
+    """
+    if _shared is None or not _shared[1].in_transaction:
+        yield
+        return
+
+    raw_conn = _shared[1]
+    raw_conn.rollback()
+    try:
+        yield
+    finally:
+        # 書き込んだ内容も参照できるように、新しく読み込みのトランザクションを開始します。
+        raw_conn.cursor().execute('BEGIN')
+
+
+def refresh_command_snapshot():
+    """start_command_scopeの読み込みのトランザクションを終了して、新しく開始し直します。
+    以降は、この時点までに他の接続で書き込まれたデータを参照します。
+    スコープ外、またはトランザクションを開始していない（WALモードでない）場合は何もしません。
+    """
+    with _pause_command_scope():
+        pass
 
 
 @contextmanager
@@ -36,22 +237,30 @@ def start_session(commit=False):
         with start_session() as session:
             q = session.query(Table)...
     """
+    if not commit and _shared is not None:
+        # start_command_scopeの実行中は、共有しているセッションを使います。
+        DBStats.num_reuses += 1
+        yield _shared[0]
+        return
+
     session = None
-    try:
-        # トランザクションを開始します。
-        # ※autocommit=Falseなので、自動的にトランザクションが開始されます。
-        session = Session()
+    with _pause_command_scope() if commit else ExitStack():
         try:
-            yield session
-            if commit:
-                session.commit()
-        except:
-            # 例外発生時はトランザクションをロールバックして、その例外をそのまま投げます。
-            session.rollback()
-            raise
-    finally:
-        if session is not None:
-            session.close()
+            # トランザクションを開始します。
+            # ※autocommit=Falseなので、自動的にトランザクションが開始されます。
+            session = Session(bind=get_engine(commit))
+            DBStats.num_sessions += 1
+            try:
+                yield session
+                if commit:
+                    session.commit()
+            except:
+                # 例外発生時はトランザクションをロールバックして、その例外をそのまま投げます。
+                session.rollback()
+                raise
+        finally:
+            if session is not None:
+                session.close()
 
 
 @contextmanager
@@ -69,29 +278,54 @@ def start_raw_connection(commit=False):
             c = conn.cursor()
             c.execute('SELECT 1')
     """
+    if not commit and _shared is not None:
+        # start_command_scopeの実行中は、共有しているコネクションを使います。
+        DBStats.num_reuses += 1
+        yield _shared[1]
+        return
+
     conn = None
-    try:
-        conn = engine.raw_connection()
+    with _pause_command_scope() if commit else ExitStack():
         try:
-            yield conn
-            if commit:
-                conn.commit()
-        except:
-            conn.rollback()
-            raise
-    finally:
-        if conn is not None:
-            conn.close()
+            conn = get_engine(commit).raw_connection()
+            DBStats.num_connections += 1
+            try:
+                yield conn
+                if commit:
+                    conn.commit()
+            except:
+                conn.rollback()
+                raise
+        finally:
+            if conn is not None:
+                conn.close()
 
 
 @event.listens_for(Engine, 'connect')
 def set_sqlite_pragma(dbapi_connection, connection_record):
+    """接続時にPRAGMAを設定します。const.SQLITE_PROFILEで選択したプロファイルの設定も反映します。"""
     import sqlite3
     if type(dbapi_connection) == sqlite3.Connection:
         cursor = dbapi_connection.cursor()
         cursor.execute('PRAGMA foreign_keys = ON')
+
+        readonly = cursor.execute('PRAGMA query_only').fetchone()[0] == 1
+        schemas = ['main']
+        if const.HISTORY_SHARD_FILES:
+            _attach_history_shards(cursor, readonly)
+            schemas += ['shard_' + name for name in get_history_shard_names()]
+
+        for name, value in const.SQLITE_PROFILES[const.SQLITE_PROFILE].items():
+            # 読み込み専用の接続ではjournal_modeを変更できないので飛ばします。
+            if readonly and name == 'journal_mode':
+                continue
+            for schema in schemas:  # ATTACHしたDBにも同じ設定をします。
+                cursor.execute('PRAGMA {}.{} = {}'.format(schema, name, value))
         cursor.close()
 
+        # PRAGMAを除いて、実行したSQLを数えます。
+        dbapi_connection.set_trace_callback(DBStats.count_query)
+
 
 class Sector(Base):
     """セクターの情報を持つクラスです。"""
@@ -124,6 +358,31 @@ class Sector(Base):
         session.add(sector)
         return sector, True
 
+    @classmethod
+    def get_or_create_all(cls, session, names):
+        """複数のセクターをまとめて取得・作成し、セクター名とIDの対応を取得します。
+        登録済みのセクターは1回のクエリで取得し、未登録のセクターはまとめて作成します。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            names: セクター名のiterable
+
+        Returns:
+            key: セクター名、value: セクターIDのdict型オブジェクト
+            新規作成したセクター名のリスト
+        """
+        names = set(name.strip() for name in names)
+        sector_ids = {name: sector_id for (sector_id, name) in session.query(cls.id, cls.name)}
+
+        created_names = sorted(names - set(sector_ids.keys()))
+        if created_names:
+            # 未登録のセクターをまとめて作成し、採番されたIDを取得します。
+            session.bulk_insert_mappings(cls, [{'name': name} for name in created_names])
+            sector_ids.update({name: sector_id for (sector_id, name)
+                               in session.query(cls.id, cls.name).filter(cls.name.in_(created_names))})
+
+        return sector_ids, created_names
+
 
 class Stock(Base):
     """銘柄の情報を持つクラスです。"""
@@ -134,10 +393,13 @@ class Stock(Base):
     SYMBOL_LENGTH = 16  # symbolカラムの長さを定義します。
 
     symbol = Column(String(SYMBOL_LENGTH), primary_key=True)  # 銘柄のシンボル
+    symbol_lower = Column(String(SYMBOL_LENGTH), index=True)  # 小文字にしたシンボル（大文字小文字を区別しない検索用）
     name = Column(String(64), nullable=False)  # 銘柄の名前
     market_id = Column(Integer, nullable=False)  # マーケットID
     sector_id = Column(Integer, index=True, nullable=False)  # セクターID
-    activated = Column(Boolean, default=False)  # Trueだとbacktestなどの対象になります。
+    activated = Column(Boolean, default=False, index=True)  # Trueだとbacktestなどの対象になります。
+    # 履歴データやファイナンシャルデータを更新するたびに増える番号です。キャッシュのキーに使います。
+    data_version = Column(Integer, nullable=False, default=0, server_default='0')
     created_at = Column(DateTime, default=datetime.now())  # 作成日時
     updated_at = Column(DateTime, default=datetime.now(), onupdate=datetime.now())  # 更新日時
 
@@ -146,28 +408,113 @@ class Stock(Base):
         """コンストラクタ"""
         self.start_date = None
         self.end_date = None
+        self._prefetched_series = None  # prefetch_historiesでまとめて取得した履歴データ
+        self._histories = None  # start_date, end_dateで絞り込んだ履歴データ
+        self._histories_range = None  # _historiesを絞り込んだときの(start_date, end_date)
 
     @cached_property
+    def full_histories(self):
+        """全期間の履歴データを取得します。
+        ※このプロパティの結果はキャッシュされます。
+
+        Returns:
+            ppyt.models.series.HistorySeries（列ごとのnumpy配列）
+        """
+        if self._prefetched_series is not None:
+            # prefetch_historiesで取得済みの場合は、DBを参照しません。
+            return self._prefetched_series
+
+        if const.USE_HISTORY_CACHE:
+            # キャッシュファイルがある場合は、DBを参照せずにメモリマップした配列を使います。
+            series = HistoryCache.load(self.symbol, self.data_version)
+            if series is not None:
+                return series
+
+        return get_history_class(self.symbol, self.market_id).get_series(self.symbol)
+
+    @property
     def histories(self):
-        """履歴データ（日毎の価格や出来高などを）を取得します。
-        ※このプロパティの結果はキャッシュされます。そのため、
-        日付（start_date, end_date）を設定してから呼ぶようにしてください。
+        """履歴データ（日毎の価格や出来高などを）を、start_dateからend_dateの期間で取得します。
+        全期間の履歴データのビューを返すので、期間を変えてもDBを参照し直しません。
 
         Returns:
-            ppyt.models.orm.HistoryBase（のサブクラス）のリスト
+            ppyt.models.series.HistorySeries（列ごとのnumpy配列）
         """
-        with start_session() as session:
-            query = session.query(History).filter_by(symbol=self.symbol)
+        date_range = (self.start_date, self.end_date)
+        if self._histories is None or self._histories_range != date_range:
+            self._histories = self.full_histories.slice_dates(*date_range)
+            self._histories_range = date_range
+        return self._histories
 
-            if self.start_date is not None:
-                # start_dateが設定されている場合は絞り込み条件に追加します。
-                query = query.filter(History.date >= self.start_date)
+    @classmethod
+    def prefetch_histories(cls, stocks):
+        """複数の銘柄の履歴データ（全期間）を1回のクエリでまとめて取得し、各銘柄に設定します。
+        銘柄ごとにクエリを発行するよりも、コネクションの取得やクエリの実行回数を減らせます。
 
-            if self.end_date is not None:
-                # end_dateが設定されている場合は絞り込み条件に追加します。
-                query = query.filter(History.date <= self.end_date)
+        Args:
+            stocks: Stockのインスタンスのリスト
+        """
+        targets = []
+        for stock in stocks:
+            series = HistoryCache.load(stock.symbol, stock.data_version) if const.USE_HISTORY_CACHE else None
+            if series is not None:
+                # キャッシュファイルがある銘柄は、クエリの対象から外します。
+                stock._prefetched_series = series
+            else:
+                targets.append(stock)
+
+        if len(targets) == 0:
+            return
+
+        # 履歴データのテーブルを分割している場合は、テーブルごとにまとめて取得します。
+        series_dict = {}
+        for history_class, symbols in group_by_history_class(
+                [(s.symbol, s.market_id) for s in targets]).items():
+            series_dict.update(history_class.get_series_dict(symbols))
+
+        for stock in targets:
+            stock._prefetched_series = series_dict.get(stock.symbol, HistorySeries.empty())
 
-            return query.order_by('date').all()
+    @classmethod
+    def increment_data_versions(cls, session, symbols):
+        """銘柄のデータのバージョンを1つ進めます。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            symbols: データを更新した銘柄のシンボルのリスト
+        """
+        for i in range(0, len(symbols), HistoryStatus.MAX_SYMBOLS_PER_QUERY):
+            session.query(cls) \
+                .filter(cls.symbol.in_(symbols[i:i + HistoryStatus.MAX_SYMBOLS_PER_QUERY])) \
+                .update({cls.data_version: cls.data_version + 1}, synchronize_session=False)
+
+    @classmethod
+    def get_data_versions(cls, session, symbols):
+        """銘柄のデータのバージョンを取得します。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            symbols: 銘柄のシンボルのリスト
+
+        Returns:
+            key: シンボル、value: data_versionのdict型オブジェクト
+        """
+        versions = {}
+        for i in range(0, len(symbols), HistoryStatus.MAX_SYMBOLS_PER_QUERY):
+            versions.update(session.query(cls.symbol, cls.data_version)
+                            .filter(cls.symbol.in_(symbols[i:i + HistoryStatus.MAX_SYMBOLS_PER_QUERY])))
+        return versions
+
+    @classmethod
+    def increment_data_versions_in(cls, cursor, table_name):
+        """指定したテーブルに含まれる銘柄のデータのバージョンを1つ進めます。
+
+        Args:
+            cursor: DBのカーソル（呼び出し側のトランザクションで実行します。）
+            table_name: symbolカラムを持つテーブルの名前
+        """
+        cursor.execute('UPDATE {} SET data_version = data_version + 1 '
+                       'WHERE symbol IN (SELECT DISTINCT symbol FROM {})'.format(cls.__tablename__, table_name))
 
     @classmethod
     def save(cls, session, name, symbol, market_id, sector_name):
@@ -193,14 +540,80 @@ class Stock(Base):
 
         stock.name = name
         stock.symbol = symbol
+        stock.symbol_lower = symbol.lower()
         stock.market_id = market_id
         stock.sector_id = sector.id
 
         if create_flag:
             session.add(stock)
 
+    @classmethod
+    def save_all(cls, session, market_id, rows):
+        """1マーケット分の銘柄情報をまとめて新規作成・更新します。
+        セクターと登録済みの銘柄を先にまとめて取得しておき、新規作成と更新をそれぞれ一括で実行します。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            market_id: マーケットID
+            rows: (symbol, name, sector_name)のtupleのiterable
+
+        Returns:
+            新規作成した件数
+            更新した件数
+        """
+        # 同じsymbolが複数回出現した場合は、後の行の内容を優先します。
+        data = {}
+        for symbol, name, sector_name in rows:
+            data[symbol.strip()] = (name.strip(), sector_name.strip())
+
+        sector_ids, created_names = Sector.get_or_create_all(
+            session, [sector_name for (_, sector_name) in data.values()])
+        for sector_name in created_names:
+            logger.info('セクター[{}]が新規作成されませした。'.format(sector_name))
+
+        # key: 登録済みの銘柄のシンボル、value: マーケットID
+        existing_market_ids = dict(session.query(cls.symbol, cls.market_id))
+        inserts, updates = [], []
+        for symbol, (name, sector_name) in data.items():
+            mapping = {'symbol': symbol,
+                       'symbol_lower': symbol.lower(),
+                       'name': name,
+                       'market_id': market_id,
+                       'sector_id': sector_ids[sector_name]}
+            if symbol in existing_market_ids:
+                updates.append(mapping)
+                if existing_market_ids[symbol] != market_id:
+                    cls.__move_histories(session, symbol, existing_market_ids[symbol], market_id)
+            else:
+                inserts.append(mapping)
+
+        session.bulk_insert_mappings(cls, inserts)
+        session.bulk_update_mappings(cls, updates)
+        return len(inserts), len(updates)
+
+    @classmethod
+    def __move_histories(cls, session, symbol, old_market_id, new_market_id):
+        """マーケットが変わった銘柄の履歴データを、新しいマーケットのテーブルに移動します。
+        マーケットごとにテーブルを分割していない場合は、何もしません。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            symbol: 銘柄のシンボル
+            old_market_id: 変更前のマーケットID
+            new_market_id: 変更後のマーケットID
+        """
+        old_class = get_history_class(symbol, old_market_id)
+        new_class = get_history_class(symbol, new_market_id)
+        if old_class is new_class:
+            return
+
+        num_rows = old_class.move_histories(session, symbol, new_class)
+        logger.info('銘柄[{}]のマーケットが変わったので、履歴データ{:,d}件をテーブル[{}]から[{}]に移動しました。'
+                    .format(symbol, num_rows, old_class.__table__.fullname, new_class.__table__.fullname))
+
     def set_date(self, start_date, end_date):
         """historiesの絞り込みに使う開始日と終了日を設定します。
+        何度でも設定し直すことができます。
 
         Args:
             start_date: 開始日
@@ -209,22 +622,18 @@ class Stock(Base):
         self.start_date = start_date
         self.end_date = end_date
 
-    def get_history(self, idx):
-        """indexを指定した日の履歴情報を1件取得します。
+    def _check_index(self, idx):
+        """indexが履歴データの範囲内にあるかをチェックします。
 
         Args:
             idx: 日付を特定できるindex
 
-        Returns:
-            履歴情報（ppyt.models.orm.HistoryBaseのサブクラス）
-
         Raises:
             NoDataError: idxに対する履歴データが存在しない場合
         """
         from ppyt.exceptions import NoDataError
         if idx < 0 or idx >= len(self.histories):
             raise NoDataError()
-        return self.histories[idx]
 
     def get_date(self, idx):
         """indexに対する日付を取得します。
@@ -235,7 +644,36 @@ class Stock(Base):
         Returns:
             日付（datetime.dateクラスのオブジェクト）
         """
-        return self.get_history(idx).date
+        self._check_index(idx)
+        return self.histories.dates[idx].item()
+
+    def index_of(self, date):
+        """指定した日付のindexを取得します。get_dateの逆の変換です。
+
+        Args:
+            date: 日付（datetime.dateクラスのオブジェクトなど）
+
+        Returns:
+            日付を特定できるindex
+
+        Raises:
+            NoDataError: 指定した日付の履歴データがない場合に発生します。
+        """
+        return self.histories.index_of(date)
+
+    def indices_of(self, dates, side='left'):
+        """複数の日付に対応するindexを、二分探索でまとめて取得します。
+        詳細はHistorySeries.indices_ofを参照してください。
+
+        Args:
+            dates: 日付のリスト
+            side: 'left'の場合はその日以降で最初のindex、
+                  'right'の場合はその日より後で最初のindex
+
+        Returns:
+            indexの配列（numpyの配列）
+        """
+        return self.histories.indices_of(dates, side)
 
     def get_price(self, idx, price_type=const.PRICE_TYPE_CLOSE):
         """indexで指定した日の価格情報を取得します。取得する価格の種類はprice_typeで決定します。
@@ -247,7 +685,8 @@ class Stock(Base):
         Returns:
             価格
         """
-        return getattr(self.get_history(idx), price_type)
+        self._check_index(idx)
+        return getattr(self.histories, price_type)[idx]
 
     def get_open_price(self, idx):
         """indexで指定した日の始値を取得します。"""
@@ -272,17 +711,29 @@ class Stock(Base):
             price_type: 価格種別
 
         Returns:
-            価格のリスト
+            価格の配列（numpyの配列）
         """
-        return [getattr(self.histories[idx], price_type) for idx in range(len(self.histories))]
+        return getattr(self.histories, price_type)
 
 
 class HistoryBase(object):
-    """履歴情報（日毎の始値、終値などを保存持つ）の親クラスです。"""
-    __table_args__ = (
-        ForeignKeyConstraint(['symbol'], ['stock.symbol'],
-                             onupdate='CASCADE', ondelete='CASCADE'),
-    )
+    """履歴情報（日毎の始値、終値などを保存持つ）の親クラスです。
+    WITHOUT ROWIDのテーブルにして、(symbol, date)の順でレコードを格納します。
+    そのため、1銘柄分の履歴データは連続した領域から読み込めます。
+    const.HISTORY_SHARDINGを設定すると、このクラスを継承したテーブルが分割した単位ごとに定義されます。"""
+    _schema = None  # 別のDBファイルに保存する場合に、ATTACHしたときのスキーマ名を設定します。
+
+    @declared_attr
+    def __table_args__(cls):
+        if cls._schema is not None:
+            # 別のDBファイルのテーブルには外部キーを設定できません。
+            return {'sqlite_with_rowid': False, 'schema': cls._schema}
+
+        return (
+            ForeignKeyConstraint(['symbol'], ['stock.symbol'],
+                                 onupdate='CASCADE', ondelete='CASCADE'),
+            {'sqlite_with_rowid': False},
+        )
 
     symbol = Column(String(Stock.SYMBOL_LENGTH), primary_key=True)
     date = Column(Date, primary_key=True)  # 日付
@@ -326,6 +777,102 @@ class HistoryBase(object):
         if create_flag:
             session.add(hist)
 
+    @classmethod
+    def get_series(cls, symbol, start_date=None, end_date=None):
+        """銘柄の履歴データを、日付順に並んだ列ごとの配列で取得します。
+
+        Args:
+            symbol: 銘柄のシンボル
+            start_date: 開始日（Noneの場合は絞り込みません）
+            end_date: 終了日（Noneの場合は絞り込みません）
+
+        Returns:
+            ppyt.models.series.HistorySeries
+        """
+        sql, params = cls._build_series_query(HistorySeries.COLUMNS, [symbol], start_date, end_date)
+
+        # ORMのオブジェクトを経由せず、取得した行から直接配列を組み立てます。
+        with start_raw_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql + ' ORDER BY date', params)
+            return HistorySeries.from_rows(cursor.fetchall())
+
+    @classmethod
+    def get_series_dict(cls, symbols, start_date=None, end_date=None):
+        """複数の銘柄の履歴データを1回のクエリで取得し、銘柄ごとの列の配列に分割します。
+
+        Args:
+            symbols: 銘柄のシンボルのリスト
+            start_date: 開始日（Noneの場合は絞り込みません）
+            end_date: 終了日（Noneの場合は絞り込みません）
+
+        Returns:
+            key: シンボル、value: HistorySeriesのdict型オブジェクト
+            ※履歴データが1件もない銘柄は含まれません。
+        """
+        if len(symbols) == 0:
+            return {}
+
+        sql, params = cls._build_series_query(('symbol', ) + HistorySeries.COLUMNS,
+                                              symbols, start_date, end_date)
+
+        # 主キーの順番で取得するので、銘柄ごとのデータが連続して並びます。
+        with start_raw_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql + ' ORDER BY symbol, date', params)
+            return HistorySeries.from_rows_by_symbol(cursor.fetchall())
+
+    @classmethod
+    def _build_series_query(cls, columns, symbols, start_date=None, end_date=None):
+        """履歴データを取得するSQL（ORDER BYなし）と、そのパラメータを生成します。
+
+        Args:
+            columns: 取得するカラム名のリスト
+            symbols: 銘柄のシンボルのリスト
+            start_date: 開始日（Noneの場合は絞り込みません）
+            end_date: 終了日（Noneの場合は絞り込みません）
+
+        Returns:
+            SQLとパラメータのリストのtuple
+        """
+        sql = 'SELECT {} FROM {} WHERE symbol IN ({})'.format(
+            ', '.join(columns), cls.__table__.fullname, ', '.join(['?'] * len(symbols)))
+        params = list(symbols)
+
+        if start_date is not None:
+            # start_dateが設定されている場合は絞り込み条件に追加します。
+            sql += ' AND date >= ?'
+            params.append(start_date.isoformat())
+
+        if end_date is not None:
+            # end_dateが設定されている場合は絞り込み条件に追加します。
+            sql += ' AND date <= ?'
+            params.append(end_date.isoformat())
+
+        return sql, params
+
+    @classmethod
+    def move_histories(cls, session, symbol, history_class):
+        """銘柄の履歴データを、このテーブルから別の（分割した）テーブルに移動します。
+        銘柄のマーケットが変わって、保存先のテーブルが変わった場合に使います。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            symbol: 銘柄のシンボル
+            history_class: 移動先のテーブルのクラス
+
+        Returns:
+            移動した件数
+        """
+        columns = ', '.join([c.name for c in cls.__table__.columns])
+        session.execute('INSERT OR REPLACE INTO {0} ({1}) SELECT {1} FROM {2} '
+                        'WHERE symbol = :symbol ORDER BY date'.format(
+                            history_class.__table__.fullname, columns, cls.__table__.fullname),
+                        {'symbol': symbol})
+        result = session.execute('DELETE FROM {} WHERE symbol = :symbol'.format(cls.__table__.fullname),
+                                 {'symbol': symbol})
+        return result.rowcount
+
     @property
     def rate(self):
         """調整後の終値と、調整前の終値の比率を取得します。
@@ -340,6 +887,270 @@ class History(HistoryBase, Base):
     __tablename__ = 'history'
 
 
+def get_history_shard_names():
+    """const.HISTORY_SHARDINGに従って、履歴データのテーブルを分割する単位の名前の一覧を取得します。
+
+    Returns:
+        分割する単位の名前のリスト（分割しない場合は空のリスト）
+    """
+    if const.HISTORY_SHARDING == const.HISTORY_SHARDING_MARKET:
+        return [const.MARKET_DATA[market_id] for market_id in sorted(const.MARKET_DATA)]
+
+    if const.HISTORY_SHARDING == const.HISTORY_SHARDING_HASH:
+        return ['{:02d}'.format(i) for i in range(const.HISTORY_NUM_HASH_SHARDS)]
+
+    return []
+
+
+def get_history_classes():
+    """履歴データを保存するテーブルのクラスの一覧を取得します。
+
+    Returns:
+        HistoryBaseを継承したクラスのリスト
+    """
+    names = get_history_shard_names()
+    if len(names) == 0:
+        return [History]
+    return [DEFINED_TABLE_CLASSES['{}_{}'.format(History.__tablename__, name)] for name in names]
+
+
+def get_history_class(symbol, market_id):
+    """銘柄の履歴データを保存するテーブルのクラスを取得します。
+
+    Args:
+        symbol: 銘柄のシンボル
+        market_id: 銘柄のマーケットID
+
+    Returns:
+        HistoryBaseを継承したクラス
+
+    Raises:
+        CommandError: マーケットごとに分割していて、未知のマーケットIDが指定された場合に発生します。
+    """
+    if const.HISTORY_SHARDING == const.HISTORY_SHARDING_MARKET:
+        if market_id not in const.MARKET_DATA:
+            raise CommandError('銘柄[{}]のマーケットID[{}]に対応するテーブルがありません。'
+                               .format(symbol, market_id))
+        name = const.MARKET_DATA[market_id]
+
+    elif const.HISTORY_SHARDING == const.HISTORY_SHARDING_HASH:
+        # プロセスごとに値が変わらないように、組み込みのhashではなくCRC32を使います。
+        name = '{:02d}'.format(zlib.crc32(symbol.encode('utf-8')) % const.HISTORY_NUM_HASH_SHARDS)
+
+    else:
+        return History
+
+    return DEFINED_TABLE_CLASSES['{}_{}'.format(History.__tablename__, name)]
+
+
+def group_by_history_class(symbol_market_ids):
+    """銘柄を、履歴データを保存するテーブルのクラスごとにまとめます。
+
+    Args:
+        symbol_market_ids: (シンボル, マーケットID)のiterable
+
+    Returns:
+        key: HistoryBaseを継承したクラス、value: シンボルのリストのOrderedDict
+    """
+    groups = OrderedDict()
+    for symbol, market_id in symbol_market_ids:
+        groups.setdefault(get_history_class(symbol, market_id), []).append(symbol)
+    return groups
+
+
+def _define_history_shards():
+    """const.HISTORY_SHARDINGに従って、分割した履歴データのテーブルのクラスを定義します。
+    テーブル名はhistory_<分割する単位の名前>になります。"""
+    for name in get_history_shard_names():
+        tablename = '{}_{}'.format(History.__tablename__, name)
+        attrs = {
+            '__tablename__': tablename,
+            '_schema': 'shard_' + name if const.HISTORY_SHARD_FILES else None,
+        }
+        DEFINED_TABLE_CLASSES[tablename] = type(
+            'History' + name.capitalize(), (HistoryBase, Base), attrs)
+
+
+def _attach_history_shards(cursor, readonly):
+    """分割した履歴データのDBファイルをATTACHします。
+
+    Args:
+        cursor: DBのカーソル
+        readonly: Trueの場合は読み込み専用でATTACHします。
+    """
+    for name in get_history_shard_names():
+        filepath = const.HISTORY_SHARD_DB_PATH.format('{}_{}'.format(History.__tablename__, name))
+        cursor.execute('ATTACH DATABASE ? AS {}'.format('shard_' + name),
+                       ('file:{}?mode=ro'.format(filepath) if readonly else filepath, ))
+
+
+class HistoryStatus(Base):
+    """銘柄ごとに、履歴データをどの日付まで取り込んだか（ハイウォーターマーク）を保持するクラスです。
+    update_dataで履歴データを登録・更新したときに、同じトランザクションで更新します。"""
+    __tablename__ = 'history_status'
+    __table_args__ = (
+        ForeignKeyConstraint(['symbol'], ['stock.symbol'],
+                             onupdate='CASCADE', ondelete='CASCADE'),
+    )
+    MAX_SYMBOLS_PER_QUERY = 500  # 1回のクエリで指定するシンボルの最大数（SQLiteの変数の上限より小さくします。）
+
+    symbol = Column(String(Stock.SYMBOL_LENGTH), primary_key=True)
+    last_date = Column(Date, nullable=False)  # 取り込み済みの履歴データの最終日
+
+    @classmethod
+    def refresh(cls, cursor, table_name, history_class=History):
+        """指定したテーブルに含まれる銘柄の最終日を、履歴データのテーブルから取得して更新します。
+
+        Args:
+            cursor: DBのカーソル（呼び出し側のトランザクションで実行します。）
+            table_name: symbolカラムを持つテーブルの名前（更新対象の銘柄を絞り込むのに使います。）
+            history_class: 履歴データのテーブルのクラス
+        """
+        cursor.execute('INSERT OR REPLACE INTO {0} (symbol, last_date) '
+                       'SELECT symbol, MAX(date) FROM {1} '
+                       'WHERE symbol IN (SELECT DISTINCT symbol FROM {2}) GROUP BY symbol'
+                       .format(cls.__tablename__, history_class.__table__.fullname, table_name))
+
+    @classmethod
+    def get_last_histories(cls, symbols, history_class=History):
+        """銘柄ごとに、最終日の履歴データを取得します。
+
+        Args:
+            symbols: 銘柄のシンボルのリスト
+            history_class: 銘柄の履歴データを保存しているテーブルのクラス
+
+        Returns:
+            key: シンボル、value: HistorySeries.COLUMNSの順番のtupleのdict型オブジェクト
+            ※まだ履歴データを取り込んでいない銘柄は含まれません。
+        """
+        columns = ', '.join(['h.' + c for c in HistorySeries.COLUMNS])
+        result = {}
+        with start_raw_connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(symbols), cls.MAX_SYMBOLS_PER_QUERY):
+                chunk = symbols[i:i + cls.MAX_SYMBOLS_PER_QUERY]
+                cursor.execute('SELECT s.symbol, {} FROM {} s INNER JOIN {} h '
+                               'ON h.symbol = s.symbol AND h.date = s.last_date '
+                               'WHERE s.symbol IN ({})'.format(
+                                   columns, cls.__tablename__, history_class.__table__.fullname,
+                                   ', '.join(['?'] * len(chunk))), chunk)
+                result.update({row[0]: row[1:] for row in cursor.fetchall()})
+
+        return result
+
+
+class CorporateAction(Base):
+    """株式分割などのコーポレートアクションを保持するクラスです。
+    権利落ち日より前の履歴データの調整後の価格を、分割比率でまとめて調整し直すのに使います。"""
+    __tablename__ = 'corporate_action'
+    __table_args__ = (
+        ForeignKeyConstraint(['symbol'], ['stock.symbol'],
+                             onupdate='CASCADE', ondelete='CASCADE'),
+    )
+
+    symbol = Column(String(Stock.SYMBOL_LENGTH), primary_key=True)
+    date = Column(Date, primary_key=True)  # 権利落ち日（この日より前の履歴データが調整対象になります。）
+    ratio = Column(Float, nullable=False)  # 分割比率（1株が何株になるか。1:2の分割なら2、10:1の併合なら0.1）
+    applied = Column(Boolean, nullable=False, default=False, index=True)  # 履歴データに反映済みの場合はTrue
+    created_at = Column(DateTime, default=datetime.now)  # 作成日時
+
+    @classmethod
+    def save_all(cls, session, rows):
+        """コーポレートアクションをまとめて登録します。
+        反映済みのコーポレートアクションは、履歴データを調整し直せないので更新しません。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            rows: symbol, date, ratioをkeyに持つdict型オブジェクトのiterable
+
+        Returns:
+            登録・更新した件数
+            反映済みのため更新しなかった件数
+        """
+        rows = list(rows)
+
+        # 登録済みのコーポレートアクションを、先に銘柄単位でまとめて取得しておきます。
+        # key: (symbol, date)、value: CorporateActionのインスタンス
+        actions = {}
+        symbols = sorted(set(row['symbol'] for row in rows))
+        for i in range(0, len(symbols), HistoryStatus.MAX_SYMBOLS_PER_QUERY):
+            q = session.query(cls).filter(cls.symbol.in_(symbols[i:i + HistoryStatus.MAX_SYMBOLS_PER_QUERY]))
+            actions.update({(action.symbol, action.date): action for action in q})
+
+        num_saved, num_skipped = 0, 0
+        for row in rows:
+            action = actions.get((row['symbol'], row['date']))
+            if action is None:
+                action = cls(symbol=row['symbol'], date=row['date'], applied=False)
+                session.add(action)
+                actions[(row['symbol'], row['date'])] = action
+            elif action.applied:
+                if action.ratio != row['ratio']:
+                    logger.warning('銘柄[{}]の{}のコーポレートアクションは反映済みのため、更新しません。'
+                                   .format(row['symbol'], row['date']))
+                num_skipped += 1
+                continue
+
+            action.ratio = row['ratio']
+            num_saved += 1
+
+        return num_saved, num_skipped
+
+    @classmethod
+    def apply_pending(cls, cursor, symbol, history_class=History):
+        """未反映のコーポレートアクションを、銘柄の履歴データに反映します。
+        複数ある場合も、CASE式で行ごとの比率を求めて1回のUPDATEで調整します。
+        調整前の終値（raw_close_price）は変更しないので、HistoryBase.rateが分割比率の分だけ変わります。
+
+        Args:
+            cursor: DBのカーソル（呼び出し側のトランザクションで実行します。）
+            symbol: 銘柄のシンボル
+            history_class: 銘柄の履歴データを保存しているテーブルのクラス
+
+        Returns:
+            調整した履歴データの件数
+        """
+        cursor.execute('SELECT date, ratio FROM {} WHERE symbol = ? AND applied = 0 ORDER BY date'
+                       .format(cls.__tablename__), (symbol, ))
+        actions = cursor.fetchall()
+        if len(actions) == 0:
+            return 0
+
+        # 権利落ち日より前の行は、それ以降の全ての分割比率の積で調整します。
+        # 例: 2016-01-01に2分割、2017-01-01に3分割の場合、2016-01-01より前は6、その後は3で割ります。
+        cases, params = [], []
+        factor = 1.0
+        for date, ratio in reversed(actions):
+            factor *= ratio
+            cases.insert(0, 'WHEN date < ? THEN ?')
+            params[0:0] = [date, factor]
+        factor = 'CASE {} END'.format(' '.join(cases))
+
+        cursor.execute('UPDATE {0} SET open_price = open_price / {1}, high_price = high_price / {1}, '
+                       'low_price = low_price / {1}, close_price = close_price / {1}, '
+                       'volume = CAST(ROUND(volume * {1}) AS INTEGER) '
+                       'WHERE symbol = ? AND date < ?'.format(history_class.__table__.fullname, factor),
+                       params * 5 + [symbol, actions[-1][0]])
+        num_rows = cursor.rowcount
+
+        cursor.execute('UPDATE {} SET applied = 1 WHERE symbol = ? AND applied = 0'
+                       .format(cls.__tablename__), (symbol, ))
+        cursor.execute('UPDATE {} SET data_version = data_version + 1 WHERE symbol = ?'
+                       .format(Stock.__tablename__), (symbol, ))
+        return num_rows
+
+
+class ImportedFile(Base):
+    """インポート済みのCSVファイルを、内容のチェックサムで記録するクラスです。
+    同じ内容のファイルが再度置かれた場合に、解析せずにスキップするのに使います。"""
+    __tablename__ = 'imported_file'
+
+    checksum = Column(String(64), primary_key=True)  # ファイルの内容のSHA-256
+    filename = Column(String(255), nullable=False)  # インポートしたときのファイル名
+    num_rows = Column(Integer, nullable=False)  # 登録・更新した件数
+    created_at = Column(DateTime, default=datetime.now)  # 作成日時
+
+
 class FinancialData(Base):
     """ファイナンシャル情報を保持するクラスです。"""
     __tablename__ = 'financial_data'
@@ -347,6 +1158,8 @@ class FinancialData(Base):
         # UniqueConstraint('symbol', 'year', 'quarter'),
         ForeignKeyConstraint(['symbol'], ['stock.symbol'],
                              onupdate='CASCADE', ondelete='CASCADE'),
+        # 年次・四半期ごとにfiling_date順で取得するときに使うインデックスです。
+        Index('ix_financial_data_symbol_quarter_filing_date', 'symbol', 'quarter', 'filing_date'),
     )
 
     symbol = Column(String(Stock.SYMBOL_LENGTH), primary_key=True)
@@ -414,12 +1227,57 @@ class FinancialData(Base):
         if create_flag:
             session.add(f)  # 新規作成します。
 
+    @classmethod
+    def save_all(cls, session, rows):
+        """ファイナンシャル情報をまとめて新規作成・更新します。
+        登録済みの(symbol, period)を先にまとめて取得しておき、新規作成と更新をそれぞれ一括で実行します。
+        ※saveと同様に、値が空の項目は更新しません。
+
+        Args:
+            session: SQLAlchemyのセッションオブジェクト
+            rows: symbol, year, quarter, filing_date, revenue, net_income,
+                  cf_ope, cf_inv, cf_finをkeyに持つdict型オブジェクトのiterable
+
+        Returns:
+            新規作成した件数
+            更新した件数
+        """
+        value_keys = ('revenue', 'net_income', 'cf_ope', 'cf_inv', 'cf_fin')
+
+        # (symbol, period)ごとに値をまとめます。同じ期が複数回出現した場合は、空でない値を後勝ちで上書きします。
+        data = {}
+        for row in rows:
+            period = cls.get_period(year=row['year'], quarter=row['quarter'])
+            mapping = data.setdefault((row['symbol'], period), {
+                'symbol': row['symbol'],
+                'period': period,
+                'year': row['year'],
+                'quarter': row['quarter'],
+            })
+            mapping['filing_date'] = row['filing_date']
+            mapping.update({k: str_to_number(row[k]) for k in value_keys if row.get(k)})
+
+        existing_keys = set(session.query(cls.symbol, cls.period))
+        inserts, updates = [], []
+        for key, mapping in data.items():
+            if key in existing_keys:
+                # 年度とQuarterは新規作成時にのみ設定します。
+                updates.append({k: v for (k, v) in mapping.items() if k not in ('year', 'quarter')})
+            else:
+                inserts.append(mapping)
+
+        session.bulk_insert_mappings(cls, inserts)
+        session.bulk_update_mappings(cls, updates)
+        return len(inserts), len(updates)
+
 
 class Setting(Base):
     """設定情報を保存するクラスです"""
     __tablename__ = 'setting'
     KEY_RULEFILE = 'rulefile'
     KEY_FILTERFILE = 'filterfile'
+    KEY_DB_ID = 'db_id'  # DBを作成したときに割り当てるランダムなIDです。
+    INTERNAL_KEYS = (KEY_DB_ID, )  # change_settingで変更できないkey
 
     key = Column(String(64), primary_key=True)
     value = Column(String(200), nullable=True, default=None)
@@ -429,7 +1287,8 @@ class Setting(Base):
     def get_list(cls):
         """key, valueの一覧を返します。"""
         with start_session() as session:
-            return [row for row in session.query(cls).order_by('order_id')]
+            return [row for row in session.query(cls)
+                    .filter(~cls.key.in_(cls.INTERNAL_KEYS)).order_by('order_id')]
 
     @classmethod
     def get_keys(cls):
@@ -443,6 +1302,30 @@ class Setting(Base):
             row = session.query(cls).filter_by(key=key).one_or_none()
             return row.value if row else None
 
+    @classmethod
+    def get_db_id(cls):
+        """DBのIDを取得します。
+        DBを作り直すとdata_versionなどが0から数え直しになるので、
+        別のDBのデータと区別する必要があるキャッシュのキーに使います。
+
+        Returns:
+            DBのID（文字列、register_db_idで登録する前はNone）
+        """
+        return cls.get_value(cls.KEY_DB_ID)
+
+    @classmethod
+    def register_db_id(cls):
+        """DBのIDが未登録の場合は、ランダムなIDを登録します。
+        DBに書き込むので、update_data, migrate_dbコマンドの開始時に呼びます。
+        （読み込み専用のコマンドやプロセスでは呼ばないでください。）"""
+        import uuid
+        with start_raw_connection(commit=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM {} WHERE key = ?'.format(cls.__tablename__), (cls.KEY_DB_ID, ))
+            if cursor.fetchone() is None:
+                cursor.execute('INSERT OR IGNORE INTO {} (key, value, order_id) VALUES (?, ?, 0)'
+                               .format(cls.__tablename__), (cls.KEY_DB_ID, uuid.uuid4().hex))
+
     @classmethod
     def register_initials(cls):
         """Keyが未登録の場合は初期値を設定します。"""
@@ -484,5 +1367,6 @@ class Setting(Base):
                 row.value = value
 
 
-# テーブルを作成します。
+# 分割した履歴データのテーブルを定義してから、テーブルを作成します。
+_define_history_shards()
 Base.metadata.create_all(engine, checkfirst=True)
@@ -0,0 +1,192 @@
+# coding: utf-8
+import logging
+import os
+import shutil
+import numpy as np
+from ppyt import const
+from ppyt.exceptions import NoDataError
+from ppyt.models.orm import start_raw_connection, get_history_classes, Stock
+from ppyt.models.series import HistorySeries
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryPanel(object):
+    """全銘柄の履歴データを、日付×銘柄の2次元配列で保持するクラスです。
+    日付は全銘柄の取引日を合わせたもの（取引カレンダー）で、取引がない日はNaNになります。
+    配列は項目（終値など）ごとの.npyファイルに保存し、メモリマップして読み込みます。
+    そのため、日ごとに全銘柄を比較する（順位をつけるなど）処理を、銘柄ごとに読み込まずに実行できます。
+    """
+
+    CALENDAR_FILENAME = 'dates.npy'  # 取引カレンダー（日付の配列）のファイル名
+    SYMBOLS_FILENAME = 'symbols.npy'  # シンボルの配列のファイル名
+    FIELDS = HistorySeries.COLUMNS[1:]  # 2次元配列にする項目（日付以外）
+
+    def __init__(self, dates, symbols, arrays):
+        """コンストラクタ
+
+        Args:
+            dates: 取引カレンダー（datetime64[D]の配列）
+            symbols: シンボルの配列（昇順）
+            arrays: key: 項目名、value: 日付×銘柄の2次元配列のdict型オブジェクト
+        """
+        self.dates = dates
+        self.symbols = symbols
+        self.arrays = arrays
+        self.__columns = {symbol: i for (i, symbol) in enumerate(symbols.tolist())}
+
+    def get(self, field=const.PRICE_TYPE_CLOSE):
+        """項目の2次元配列（行: 日付、列: 銘柄）を取得します。
+
+        Args:
+            field: 項目名（FIELDSのいずれか）
+
+        Returns:
+            日付×銘柄の2次元配列（float64）
+        """
+        return self.arrays[field]
+
+    def column_of(self, symbol):
+        """銘柄の列のindexを取得します。
+
+        Args:
+            symbol: 銘柄のシンボル
+
+        Returns:
+            列のindex
+
+        Raises:
+            NoDataError: 銘柄のデータがない場合に発生します。
+        """
+        if symbol not in self.__columns:
+            raise NoDataError()
+        return self.__columns[symbol]
+
+    def indices_of(self, dates, side='left'):
+        """日付に対応する行のindexを、二分探索でまとめて取得します。
+        詳細はHistorySeries.indices_ofを参照してください。
+
+        Args:
+            dates: 日付のリスト
+            side: 'left'または'right'
+
+        Returns:
+            indexの配列
+        """
+        return np.searchsorted(self.dates.view(np.int64),
+                               HistorySeries.to_date_ordinals(dates), side=side)
+
+    @classmethod
+    def load(cls, dirpath=const.HISTORY_PANEL_DIR):
+        """保存済みの2次元配列をメモリマップして読み込みます。
+
+        Args:
+            dirpath: 保存先のディレクトリ
+
+        Returns:
+            HistoryPanelのインスタンス（保存されていない場合はNone）
+        """
+        try:
+            dates = np.load(os.path.join(dirpath, cls.CALENDAR_FILENAME), mmap_mode='r')
+            symbols = np.load(os.path.join(dirpath, cls.SYMBOLS_FILENAME))
+            arrays = {field: np.load(os.path.join(dirpath, field + '.npy'), mmap_mode='r')
+                      for field in cls.FIELDS}
+        except (OSError, ValueError) as e:
+            logger.debug('2次元配列を読み込めませんでした。原因: {}'.format(e))
+            return None
+
+        return cls(dates, symbols, arrays)
+
+    @classmethod
+    def load_calendar(cls, dirpath=const.HISTORY_PANEL_DIR):
+        """取引カレンダーだけを読み込みます。
+
+        Args:
+            dirpath: 保存先のディレクトリ
+
+        Returns:
+            日付（datetime64[D]）の配列（保存されていない場合はNone）
+        """
+        try:
+            return np.load(os.path.join(dirpath, cls.CALENDAR_FILENAME), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def build(cls, dirpath=const.HISTORY_PANEL_DIR, calendar_only=False):
+        """DBの履歴データから取引カレンダーと2次元配列を作成し、ファイルに保存します。
+        2次元配列はファイルをメモリマップしたまま書き込むので、全体をメモリに載せずに作成できます。
+
+        Args:
+            dirpath: 保存先のディレクトリ
+            calendar_only: Trueの場合は、取引カレンダーとシンボルの配列だけを作成します。
+
+        Returns:
+            (日付の数, 銘柄の数)のtuple
+        """
+        history_classes = get_history_classes()
+        dates, symbols = np.array([], dtype='datetime64[D]'), np.array([], dtype=str)
+        with start_raw_connection() as conn:
+            cursor = conn.cursor()
+            for history_class in history_classes:
+                table_name = history_class.__table__.fullname
+                cursor.execute('SELECT DISTINCT date FROM {}'.format(table_name))
+                dates = np.union1d(dates, np.array([row[0] for row in cursor.fetchall()],
+                                                   dtype='datetime64[D]'))
+                cursor.execute('SELECT DISTINCT symbol FROM {}'.format(table_name))
+                symbols = np.union1d(symbols, np.array([row[0] for row in cursor.fetchall()],
+                                                       dtype='U{}'.format(Stock.SYMBOL_LENGTH)))
+
+        # 別のディレクトリに書き出してから入れ替えるので、読み込み中のプロセスに影響しません。
+        tmp_dirpath = '{}.tmp.{}'.format(dirpath, os.getpid())
+        os.makedirs(tmp_dirpath, exist_ok=True)
+        np.save(os.path.join(tmp_dirpath, cls.CALENDAR_FILENAME), dates)
+        np.save(os.path.join(tmp_dirpath, cls.SYMBOLS_FILENAME), symbols)
+
+        if not calendar_only:
+            cls.__fill_arrays(tmp_dirpath, history_classes, dates, symbols)
+
+        if os.path.isdir(dirpath):
+            old_dirpath = '{}.old.{}'.format(dirpath, os.getpid())
+            os.rename(dirpath, old_dirpath)
+            shutil.rmtree(old_dirpath)
+        os.rename(tmp_dirpath, dirpath)
+        return len(dates), len(symbols)
+
+    @classmethod
+    def __fill_arrays(cls, dirpath, history_classes, dates, symbols):
+        """履歴データを一定件数ずつ取得して、項目ごとの2次元配列のファイルに書き込みます。
+
+        Args:
+            dirpath: 保存先のディレクトリ
+            history_classes: 履歴データのテーブルのクラスのリスト
+            dates: 取引カレンダー
+            symbols: シンボルの配列（昇順）
+        """
+        arrays = {}
+        for field in cls.FIELDS:
+            arrays[field] = np.lib.format.open_memmap(
+                os.path.join(dirpath, field + '.npy'), mode='w+',
+                dtype=np.float64, shape=(len(dates), len(symbols)))
+            arrays[field][:] = np.nan  # 取引がない日はNaNにします。
+
+        date_ordinals = dates.view(np.int64)
+        with start_raw_connection() as conn:
+            cursor = conn.cursor()
+            for history_class in history_classes:
+                cursor.execute('SELECT symbol, {} FROM {}'.format(
+                    ', '.join(HistorySeries.COLUMNS), history_class.__table__.fullname))
+                while True:
+                    rows = cursor.fetchmany(const.HISTORY_PANEL_BATCH_SIZE)
+                    if len(rows) == 0:
+                        break
+
+                    columns = list(zip(*rows))
+                    cols = np.searchsorted(symbols, np.array(columns[0], dtype=symbols.dtype))
+                    idxs = np.searchsorted(date_ordinals,
+                                           HistorySeries.to_date_ordinals(columns[1]))
+                    for field, values in zip(cls.FIELDS, columns[2:]):
+                        arrays[field][idxs, cols] = np.array(values, dtype=np.float64)
+
+        for arr in arrays.values():
+            arr.flush()
@@ -0,0 +1,170 @@
+# coding: utf-8
+import logging
+import numpy as np
+from ppyt import const
+from ppyt.exceptions import NoDataError
+
+logger = logging.getLogger(__name__)
+
+
+class HistorySeries(object):
+    """履歴データ（日付、始値、終値など）を列ごとのnumpy配列で保持するクラスです。
+    ORMのオブジェクトを日数分生成せずに済むため、メモリ使用量とアクセス時間を抑えられます。
+    各配列の属性名はconst.PRICE_TYPE_XXXと一致させているので、getattrで価格種別ごとの配列を取得できます。
+    """
+
+    # historyテーブルから取得するカラムを定義します。（順番はfrom_rowsの引数と対応しています。）
+    COLUMNS = (
+        'date',
+        'raw_close_price',
+        const.PRICE_TYPE_OPEN,
+        const.PRICE_TYPE_HIGH,
+        const.PRICE_TYPE_LOW,
+        const.PRICE_TYPE_CLOSE,
+        'volume',
+    )
+
+    def __init__(self, dates, raw_close_price, open_price, high_price,
+                 low_price, close_price, volume):
+        """コンストラクタ
+
+        Args:
+            dates: 日付の配列（datetime64[D]）
+            raw_close_price: 終値（株式分割調整前）の配列
+            open_price: 始値の配列
+            high_price: 高値の配列
+            low_price: 安値の配列
+            close_price: 終値の配列
+            volume: 出来高の配列
+        """
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.raw_close_price = np.asarray(raw_close_price, dtype=np.float64)
+        self.open_price = np.asarray(open_price, dtype=np.float64)
+        self.high_price = np.asarray(high_price, dtype=np.float64)
+        self.low_price = np.asarray(low_price, dtype=np.float64)
+        self.close_price = np.asarray(close_price, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.int64)
+
+        # 日付を1970-01-01からの日数（整数）として扱うビューです。日付の検索に使います。
+        self.date_ordinals = self.dates.view(np.int64)
+
+    def __len__(self):
+        return len(self.dates)
+
+    @staticmethod
+    def to_date_ordinals(dates):
+        """日付（datetime.dateやdatetime64など）を、1970-01-01からの日数の配列に変換します。
+
+        Args:
+            dates: 日付、または日付のリスト
+
+        Returns:
+            日数（int64）の配列（スカラーを指定した場合は0次元の配列）
+        """
+        return np.asarray(dates, dtype='datetime64[D]').view(np.int64)
+
+    def index_of(self, date):
+        """指定した日付のデータのindexを取得します。
+
+        Args:
+            date: 日付
+
+        Returns:
+            index
+
+        Raises:
+            NoDataError: 指定した日付のデータがない場合に発生します。
+        """
+        ordinal = self.to_date_ordinals(date)
+        idx = int(np.searchsorted(self.date_ordinals, ordinal, side='left'))
+        if idx >= len(self) or self.date_ordinals[idx] != ordinal:
+            raise NoDataError()
+        return idx
+
+    def indices_of(self, dates, side='left'):
+        """複数の日付について、日付の配列上の位置（二分探索の結果）をまとめて取得します。
+        side='left'の場合は、その日以降で最初のデータのindexになります。
+        side='right'の場合は、その日より後で最初のデータのindexになるので、
+        1を引くとその日以前で最後のデータのindex（as-of）になります。
+        ※該当するデータがない場合は、len(self)や-1になります。
+
+        Args:
+            dates: 日付のリスト
+            side: 'left'または'right'（numpy.searchsortedのside）
+
+        Returns:
+            indexの配列
+        """
+        return np.searchsorted(self.date_ordinals, self.to_date_ordinals(dates), side=side)
+
+    @property
+    def arrays(self):
+        """COLUMNSの順番に並べた配列のtupleを取得します。"""
+        return (self.dates, self.raw_close_price, self.open_price, self.high_price,
+                self.low_price, self.close_price, self.volume)
+
+    def slice_dates(self, start_date=None, end_date=None):
+        """指定した期間のデータだけを持つインスタンスを取得します。
+        配列はコピーせず、元の配列のビューを使います。
+
+        Args:
+            start_date: 開始日（Noneの場合は先頭から）
+            end_date: 終了日（Noneの場合は末尾まで）
+
+        Returns:
+            HistorySeriesのインスタンス
+        """
+        start, end = 0, len(self)
+        if start_date is not None:
+            start = int(self.indices_of(start_date, side='left'))
+        if end_date is not None:
+            end = int(self.indices_of(end_date, side='right'))
+
+        if start == 0 and end == len(self):
+            return self
+        return self.__class__(*[arr[start:end] for arr in self.arrays])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """DBから取得した行（COLUMNSの順番のtuple）のリストからインスタンスを生成します。
+
+        Args:
+            rows: COLUMNSの順番で値が入ったtupleのリスト
+
+        Returns:
+            HistorySeriesのインスタンス
+        """
+        if len(rows) == 0:
+            return cls.empty()
+
+        # 行のリストを列のリストに組み替えてから、列ごとに配列を生成します。
+        return cls(*zip(*rows))
+
+    @classmethod
+    def from_rows_by_symbol(cls, rows):
+        """先頭にシンボルを持つ行（symbol, COLUMNSの順番のtuple）のリストから、銘柄ごとのインスタンスを生成します。
+        行はシンボルの順に並んでいる必要があります。各銘柄の配列は、まとめて生成した配列のビューになります。
+
+        Args:
+            rows: symbolとCOLUMNSの順番で値が入ったtupleのリスト（symbol, dateの順に並んだもの）
+
+        Returns:
+            key: シンボル、value: HistorySeriesのインスタンスのdict型オブジェクト
+        """
+        if len(rows) == 0:
+            return {}
+
+        columns = list(zip(*rows))
+        symbols = np.array(columns[0])
+        whole = cls(*columns[1:])
+
+        # シンボルが切り替わる位置で配列を分割します。
+        starts = np.concatenate(([0], np.flatnonzero(symbols[1:] != symbols[:-1]) + 1))
+        ends = np.append(starts[1:], len(symbols))
+        return {symbols[start]: cls(*[arr[start:end] for arr in whole.arrays])
+                for start, end in zip(starts.tolist(), ends.tolist())}
+
+    @classmethod
+    def empty(cls):
+        """データが1件もないインスタンスを生成します。"""
+        return cls(*[[] for _ in cls.COLUMNS])
@@ -1,5 +1,6 @@
 # coding: utf-8
 import logging
+import numpy as np
 from ppyt.rules.conditions import ConditionBase
 from ppyt.models.orm import start_session, FinancialData
 
@@ -28,35 +29,57 @@ class AnnualOperatingCfIncreasingCondtion(ConditionBase):
 
     def _update(self):
         """インスタンス変数を更新します。"""
-        # FinancialDataをfiling_dateの降順で取得・設定します。
+        # 年次のFinancialDataをfiling_dateの昇順で取得します。
         with start_session(commit=False) as session:
-            self.fd_list = session.query(FinancialData) \
+            fd_list = session.query(FinancialData.filing_date, FinancialData.cf_ope) \
                 .filter_by(symbol=self.stock.symbol) \
                 .filter_by(quarter=None) \
-                .order_by(FinancialData.filing_date.desc()) \
+                .order_by(FinancialData.filing_date) \
                 .all()
 
-    def _can_entry_long(self, idx):
-        # filing_dateが処理日以前のFinancialDataの一覧を取得します。
-        sub_fd_list = [fd for fd in self.fd_list
-                       if fd.filing_date <= self.get_date(idx)]
+        # 各FinancialDataが参照できるようになる（filing_date以降で最初の）日のindexを求めておきます。
+        # 処理日に参照できるFinancialDataの件数は、このindexの配列を二分探索すれば求められます。
+        self.fd_start_indices = self.stock.indices_of([fd.filing_date for fd in fd_list])
+
+        # 判定結果は、参照できるFinancialDataの件数ごとに、初めて処理日に使われたときに求めてキャッシュします。
+        self.cf_opes = [fd.cf_ope for fd in fd_list]
+        self.entry_results = {}  # key: 参照できるFinancialDataの件数、value: 判定結果
+
+    def __is_increasing(self, cf_opes):
+        """営業キャッシュフローがyears年連続で増加しているかを判定します。
 
+        Args:
+            cf_opes: 参照できる営業キャッシュフローのリスト（filing_dateの昇順）
+
+        Returns:
+            増加している場合はTrue
+        """
         year_count = 0  # 営業利益が増加した年数を保持する変数
         for i in range(self.years):
-            try:
-                fd1 = sub_fd_list[i]  # 年次のFinancialData
-                fd2 = sub_fd_list[i + 1]  # 一つ前の年のFinancialData
+            if i + 2 > len(cf_opes):
+                break
 
-                if fd1.cf_ope > 0 and fd1.cf_ope >= (fd2.cf_ope * self.rate):
-                    # 営業利益がプラス
-                    # かつ、営業利益が規定の数値分増加している場合
-                    year_count += 1  # カウントを増やします。
+            cf_ope1 = cf_opes[-1 - i]  # 年次の営業キャッシュフロー
+            cf_ope2 = cf_opes[-2 - i]  # 一つ前の年の営業キャッシュフロー
 
-            except IndexError:
-                break
+            if cf_ope1 is None or cf_ope2 is None:
+                # 営業キャッシュフローが登録されていない年は、増加していないものとして扱います。
+                continue
+
+            if cf_ope1 > 0 and cf_ope1 >= (cf_ope2 * self.rate):
+                # 営業利益がプラス
+                # かつ、営業利益が規定の数値分増加している場合
+                year_count += 1  # カウントを増やします。
 
         return self.years == year_count
 
+    def _can_entry_long(self, idx):
+        # filing_dateが処理日以前のFinancialDataの件数を取得します。
+        num = int(np.searchsorted(self.fd_start_indices, idx, side='right'))
+        if num not in self.entry_results:
+            self.entry_results[num] = self.__is_increasing(self.cf_opes[:num])
+        return self.entry_results[num]
+
     def _can_entry_short(self, idx):
         # Long専用です。
         return False
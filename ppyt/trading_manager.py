@@ -50,12 +50,13 @@ class BacktestManager(object):
         # 保有している銘柄関連の情報を格納する変数を定義します。
         # ※テスト開始時は銘柄を保持していないのでNoneになります。
         position = None
-        for idx, hist in enumerate(self.stock.histories):
+        volumes = self.stock.histories.volume  # 出来高の配列
+        for idx in range(len(self.stock.histories)):
             if position is not None:  # 前日からホールドしている場合
                 # 昨日の情報に基づき、保有後の高値などを更新します。
                 position.update(idx-1)
 
-            if hist.volume == 0:
+            if volumes[idx] == 0:
                 # 出来高がない場合は、仕掛けも手仕舞いもできないようにします。
                 continue
 
@@ -69,13 +70,13 @@ class BacktestManager(object):
                     if volume == 0:
                         continue
 
-                    if hist.volume < volume:
-                        continue  # 実際にはhist.volume / 100 とかでも現実的ではないはず
+                    if volumes[idx] < volume:
+                        continue  # 実際にはvolumes[idx] / 100 とかでも現実的ではないはず
 
                     # 注文可能な場合はポジションを立てます。
                     position = Position(stock=self.stock,
                                         order_type=entry_point['entry_group']['order_type'],
-                                        entry_date=hist.date,
+                                        entry_date=self.stock.get_date(idx),
                                         entry_price=entry_point['price'],
                                         entry_timing=entry_point['timing'],
                                         entry_group=entry_point['entry_group'],
@@ -90,7 +91,7 @@ class BacktestManager(object):
             if exit_point is not None:
                 # 手仕舞う場合
                 position.exit(
-                    exit_date=hist.date, exit_price=exit_point['price'],
+                    exit_date=self.stock.get_date(idx), exit_price=exit_point['price'],
                     exit_timing=exit_point['timing'], exit_group=exit_point['exit_group'])
                 self.result.add(position)
                 position = None  # ポジションをクリアします。
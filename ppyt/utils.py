@@ -1,5 +1,7 @@
 # coding: utf-8
+import hashlib
 import logging
+from ppyt import const
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,96 @@ def str_to_number(value, totype=float):
                         .format(type(value)))
 
 
+def strs_to_numbers(values, totype=float, strict=True):
+    """str_to_numberを配列単位で実行します。CSVの列をまとめて変換する場合に使います。
+
+    Args:
+        values: 数値を表す文字列（カンマ区切りを含んでもよい）のリスト
+        totype: 変換後の型（floatかint）
+        strict: Falseにすると、数値に変換できない値をNaNにします。
+            ※NaNは整数にできないので、totypeに関わらずfloatの配列を返します。
+            ※"inf"や"nan"はfloatとしては変換できるので、必要に応じて呼び出し側で除外してください。
+
+    Returns:
+        変換後のnumpyの配列
+    """
+    import numpy as np
+    # カンマを取り除いてから、numpyに一括で数値へ変換させます。
+    values = [v.replace(',', '') if isinstance(v, str) else v for v in values]
+    try:
+        arr = np.array(values, dtype=np.float64)
+    except ValueError:
+        if strict:
+            raise
+
+        # 変換できない値が含まれている場合だけ、1件ずつ変換します。
+        arr = np.array([_to_float_or_nan(v) for v in values], dtype=np.float64)
+
+    if totype == int and strict:  # intの場合は一旦floatにしてからキャスト
+        if not np.isfinite(arr).all() or (np.abs(arr) >= 2.0 ** 63).any():
+            raise ValueError('整数に変換できない値（inf, nan、または範囲外の値）が含まれています。')
+        return arr.astype(np.int64)
+
+    return arr
+
+
+def _to_float_or_nan(value):
+    """floatに変換します。変換できない場合はNaNを返します。"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def strs_to_dates(values):
+    """日付を表す文字列（YYYY-MM-DD）のリストを、datetime64[D]の配列に一括で変換します。
+    解析できない値と、YYYY-MM-DDの形式でない値（"2027-01"や"2027-01-04T23:59"など）は
+    NaT（日付の欠損値）になります。
+
+    Args:
+        values: 日付を表す文字列のリスト
+
+    Returns:
+        変換後のnumpyの配列
+    """
+    import numpy as np
+    try:
+        dates = np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        # 解析できない値が含まれている場合だけ、1件ずつ変換します。
+        dates = np.array([_to_date_or_nat(v) for v in values], dtype='datetime64[D]')
+
+    # numpyは年だけ、年月だけの値や時刻付きの値も日付に変換してしまうので、
+    # 文字列に戻して元の値と一致しないものはNaTにします。
+    dates[np.asarray(values, dtype=str) != dates.astype(str)] = np.datetime64('NaT')
+    return dates
+
+
+def _to_date_or_nat(value):
+    """datetime64[D]に変換します。変換できない場合はNaTを返します。"""
+    import numpy as np
+    try:
+        return np.datetime64(value, 'D')
+    except (TypeError, ValueError):
+        return np.datetime64('NaT', 'D')
+
+
+def get_file_checksum(filepath):
+    """ファイルの内容のチェックサム（SHA-256）を取得します。
+
+    Args:
+        filepath: ファイルパス
+
+    Returns:
+        16進数のチェックサムの文字列
+    """
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(const.CSV_READ_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def format_for_date(date):
     """YYYY年MM月DD日という文字列を取得します。
 